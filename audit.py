@@ -0,0 +1,176 @@
+# audit.py
+#
+# Runs a function against many scripts in parallel. Every worker process
+# imports nuke once in terminal mode and then opens the scripts it is given
+# one after another. Before every script the worker goes back to the state it
+# had right after the import: callbacks, preferences, node name counters and
+# the script, so a result does not depend on the scripts opened before it.
+# Nothing here imports nuke, the worker does that itself after its
+# environment is set up.
+
+import copy
+import os
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+class _Session:
+    """Global state of nuke in a worker right after the import, restored before every script."""
+    def __init__(self):
+        import nuke
+        import callbacks
+        self.nuke = nuke
+        # callback registrations, nuke shares these dicts and lists with callbacks.py
+        self.callbacks = {name: {key: list(calls) for key, calls in value.items()} if isinstance(value, dict) else list(value)
+                          for name, value in vars(callbacks).items() if isinstance(value, (dict, list)) and not name.startswith("__")}
+        self.callbacksModule = callbacks
+        self.preferences = {name: copy.deepcopy(knob.value()) for name, knob in nuke._preferences._data.items()}
+
+    def restore(self) -> None:
+        nuke = self.nuke
+        for name, registered in self.callbacks.items():
+            current = getattr(self.callbacksModule, name)
+            if isinstance(current, dict):
+                current.clear()
+                current.update({key: list(calls) for key, calls in registered.items()})
+            else:
+                current[:] = registered
+        preferences = nuke._preferences._data
+        for name in [name for name in preferences if name not in self.preferences]:
+            del preferences[name]
+        for name, value in self.preferences.items():
+            if preferences[name].value() != value:
+                preferences[name].setValue(copy.deepcopy(value))
+        nuke._thisNodes.clear()
+        nuke._groupStack.clear()
+        nuke.scriptClear()
+        nuke.root()._nameCounters.clear()
+        nuke.root()._freeNameIndices.clear()
+
+def _worker(func: Callable[[str], Any], conn) -> None:
+    import nuke
+    session = _Session()
+    conn.send(None)
+    while True:
+        chunk = conn.recv()
+        if chunk is None:
+            return
+        for path in chunk:
+            try:
+                session.restore()
+                nuke.scriptOpen(path)
+                message = (path, func(path), None)
+            except BaseException:
+                message = (path, None, traceback.format_exc())
+            try:
+                conn.send(message)
+            except Exception:
+                conn.send((path, None, f"Result of {func.__name__} can not be sent back:\n{traceback.format_exc()}"))
+
+class _Worker:
+    def __init__(self, context, func: Callable[[str], Any]):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker, args=(func, child), daemon=True)
+        # spawned workers inherit the environment, nuke runs without Qt in them
+        previous = os.environ.get("NUKE_DEBUG_TERMINAL")
+        os.environ["NUKE_DEBUG_TERMINAL"] = "1"
+        try:
+            self.process.start()
+        finally:
+            if previous is None:
+                del os.environ["NUKE_DEBUG_TERMINAL"]
+            else:
+                os.environ["NUKE_DEBUG_TERMINAL"] = previous
+        child.close()
+        # scripts sent to the worker and not answered yet, the first one is being opened
+        self.paths: deque = deque()
+        self.deadline: Optional[float] = None
+
+    def send(self, chunk: list) -> None:
+        self.paths.extend(chunk)
+        self.conn.send(chunk)
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.conn.close()
+
+def auditScripts(paths: Iterable[str], func: Callable[[str], Any], workers: int = None, chunksize: int = 1, timeout: float = None) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    """
+    Open every script in a pool of worker processes and call `func(path)` with the script loaded.
+    Workers start in terminal mode and import nuke once, then open their scripts one after another. Callbacks,
+    preferences and node names go back to their state after the import before every script, globals other modules
+    set are kept.
+    `func` must be picklable, i.e. defined at module level, and so must its results. The calling script needs an
+    `if __name__ == "__main__":` guard since workers are spawned.
+    Args:
+        paths (Iterable[str]): Script paths.
+        func (Callable[[str], Any]): Called with the path of the open script, its return value is the result.
+        workers (int): Optional. Number of worker processes, the number of CPUs by default.
+        chunksize (int): Optional. Number of scripts sent to a worker at a time.
+        timeout (float): Optional. Seconds a script may take to open and audit. The worker is killed and replaced when it takes longer.
+    Returns:
+        Iterator[Tuple[str, Any, Optional[str]]]: `(path, result, error)` in the order the scripts finish. `error` is None or the traceback text.
+    """
+    import multiprocessing
+    from multiprocessing.connection import wait
+
+    paths = list(paths)
+    chunksize = max(1, chunksize)
+    chunks = deque(paths[i:i + chunksize] for i in range(0, len(paths), chunksize))
+    if not chunks:
+        return
+    context = multiprocessing.get_context("spawn")
+    pool = {}
+    for _ in range(max(1, min(workers or os.cpu_count() or 1, len(chunks)))):
+        worker = _Worker(context, func)
+        worker.send(chunks.popleft())
+        pool[worker.conn] = worker
+
+    def replace(worker: _Worker) -> None:
+        """Kill worker and give the scripts it did not get to to a new one."""
+        del pool[worker.conn]
+        worker.stop(kill=True)
+        if worker.paths:
+            new = _Worker(context, func)
+            new.send(list(worker.paths))
+            pool[new.conn] = new
+
+    try:
+        while pool:
+            deadlines = [w.deadline for w in pool.values() if w.deadline is not None]
+            waitTime = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            for conn in wait(list(pool), waitTime):
+                worker = pool[conn]
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    path = worker.paths.popleft()
+                    worker.process.join(1)
+                    yield path, None, f"Worker process exited with code {worker.process.exitcode}"
+                    replace(worker)
+                    continue
+                if message is not None:
+                    worker.paths.popleft()
+                    yield message
+                worker.deadline = time.monotonic() + timeout if timeout is not None else None
+                if not worker.paths:
+                    if chunks:
+                        worker.send(chunks.popleft())
+                    else:
+                        del pool[conn]
+                        worker.stop()
+            now = time.monotonic()
+            for worker in [w for w in pool.values() if w.deadline is not None and w.deadline <= now]:
+                yield worker.paths.popleft(), None, f"Timed out after {timeout} s"
+                replace(worker)
+    finally:
+        for worker in pool.values():
+            worker.stop(kill=True)
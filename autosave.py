@@ -0,0 +1,280 @@
+# autosave.py
+#
+# Autosave of the current script, driven by the AutoSaveName, AutoSaveIdle
+# and AutoSaveTime preferences. A background thread watches the change
+# counter of the script (nuke._scriptVersion) and saves once the script has
+# been idle for AutoSaveIdle seconds, or has had unsaved changes for
+# AutoSaveTime seconds. The snapshot is taken with nuke._graphLock held, which
+# every change of the script takes as well, and the file is written after the
+# lock is released. Code holding both takes nuke._graphLock first. A full autosave goes to `<autosave>.partial` first and is
+# moved in place with _saveLock held. delete() and _reset() take that lock too
+# and start a new generation, a save that was being written when they ran is
+# dropped, so a saved script never gets its autosave back.
+# Node texts are kept between autosaves and only the nodes that changed are
+# written again. When only knob values changed since the last full autosave
+# they are appended to a journal next to it, `<autosave>.journal`, instead.
+# The filters of callbacks.py run in the order Nuke documents them:
+# autoSaveFilter before a save, autoSaveRestoreFilter before a restore and
+# autoSaveDeleteFilter when the script is saved and the autosave goes away.
+# Importing nuke in GUI mode only starts the thread when $NUKE_DEBUG_AUTOSAVE is set to something other than 0,
+# start() turns it on at any time. A failed autosave is retried after a delay that doubles up to _maxRetryDelay.
+
+from __future__ import annotations
+import os
+import threading
+import time
+import traceback
+import weakref
+from typing import Optional
+
+import nuke
+import nkscript
+import tcl
+
+_journalSuffix = ".journal"
+_partialSuffix = ".partial"
+_pollInterval = 0.5
+# seconds to wait after a failed autosave, doubled with every failure in a row up to _maxRetryDelay
+_retryDelay = 5.0
+_maxRetryDelay = 300.0
+# the journal is replaced by a full autosave once it gets this big relative to the script
+_journalRatio = 0.25
+
+class _Chunks(list):
+    """Output for nkscript.write that keeps the text, so the file can be written once the graph lock is released."""
+    write = list.append
+
+    def size(self) -> int:
+        return sum(len(chunk) for chunk in self)
+
+_thread: Optional[threading.Thread] = None
+_stopEvent = threading.Event()
+# one autosave at a time, from the thread or save()
+_writeLock = threading.Lock()
+# the state below and the autosave files, held while a save commits or the autosave is reset or deleted, not while it is written
+_saveLock = threading.Lock()
+# bumped by _reset(), a save started in an earlier generation is dropped
+_generation = 0
+# node -> (inputs, indent, text) of the last full autosave
+_blocks = weakref.WeakKeyDictionary()
+_savedVersion = 0
+_pendingSince: Optional[float] = None
+# where the last full autosave went, the structure version it had and the sizes of it and its journal
+_fullFile: Optional[str] = None
+_fullStructure = -1
+_fullSize = 0
+_journalSize = 0
+_stats = {"full": 0, "journal": 0, "nodesWritten": 0, "seconds": 0.0}
+
+def start() -> None:
+    """Start autosaving the current script in the background. Does nothing if it is running already."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stopEvent.clear()
+    _thread = threading.Thread(target=_run, name="nuke autosave", daemon=True)
+    _thread.start()
+
+def stop() -> None:
+    """Stop autosaving in the background, waiting for a save in progress."""
+    global _thread
+    _stopEvent.set()
+    if _thread is not None and _thread is not threading.current_thread():
+        _thread.join()
+    _thread = None
+
+def stats() -> dict:
+    """Number of full and journal autosaves, node blocks rendered again and the seconds spent writing them."""
+    return dict(_stats)
+
+def _preference(name: str) -> float:
+    try:
+        return float(nuke._preferences[name].value())
+    except (TypeError, ValueError):
+        return 0.0
+
+def _due(now: float) -> bool:
+    """True once the script has unsaved changes and was idle long enough, or has had them for too long."""
+    global _pendingSince
+    if nuke._scriptVersion == _savedVersion or not nuke.root().modified():
+        _pendingSince = None
+        return False
+    if _pendingSince is None:
+        _pendingSince = now
+    idle = _preference("AutoSaveIdle")
+    force = _preference("AutoSaveTime")
+    return idle > 0 and now - nuke._lastChangeTime >= idle or force > 0 and now - _pendingSince >= force
+
+def _run() -> None:
+    failures = 0
+    retryAt = 0.0
+    while not _stopEvent.wait(_pollInterval):
+        now = time.monotonic()
+        if now < retryAt:
+            continue
+        try:
+            if _due(now):
+                save()
+            failures = 0
+        except Exception:
+            # the traceback is printed for the first failure only, the next attempts wait longer and longer
+            if not failures:
+                traceback.print_exc()
+            retryAt = now + min(_retryDelay * 2 ** failures, _maxRetryDelay)
+            failures += 1
+
+def autoSaveName() -> str:
+    """The autosave file of the current script as AutoSaveName gives it, before the filters. Empty if there is none."""
+    try:
+        # the autosave thread can only use the Python evaluation, the Tcl interpreter runs on the main thread
+        return tcl.evaluate(nuke._preferences["AutoSaveName"].value())
+    except Exception:
+        name = nuke.root()["name"].value()
+        return name + ".autosave" if name else ""
+
+def _journalEntry(node: nuke.Node) -> str:
+    name = "root" if node is nuke.root() else node.fullName()
+    body = "".join(f" {knob} {value}\n" for knob, value in nkscript.knobItems(node, nuke.WRITE_ALL) if knob != "name")
+    return f"knobs {nkscript.quote(name)} {{\n{body}}}\n"
+
+def save() -> Optional[str]:
+    """
+    Autosave the current script now. Only the nodes that changed since the last autosave are written again,
+    knob changes alone go to the journal next to the last full autosave while it is small.
+    Returns:
+        str: The file saved to, None if there was nothing to save or autoSaveFilter returned None.
+    """
+    global _savedVersion, _pendingSince, _fullFile, _fullStructure, _fullSize, _journalSize
+    with _writeLock:
+        start = time.perf_counter()
+        with nuke._graphLock, _saveLock:
+            generation = _generation
+            version = nuke._scriptVersion
+            structure = nuke._structureVersion
+            dirty = list(nuke._dirtyNodes)
+            nuke._dirtyNodes.clear()
+            name = autoSaveName()
+            filename = nuke.autoSaveFilter(name) if name else None
+            if not filename:
+                _savedVersion = version
+                _pendingSince = None
+                return None
+            for node in dirty:
+                _blocks.pop(node, None)
+            full = filename != _fullFile or structure != _fullStructure or _journalSize > _fullSize * _journalRatio
+            chunks = _Chunks()
+            if full:
+                # the dirty nodes were popped above, every block missing now is rendered again
+                rendered = len(_blocks)
+                nkscript.write(chunks, nuke.root(), _blocks)
+                rendered = len(_blocks) - rendered
+            else:
+                for node in dirty:
+                    chunks.write(_journalEntry(node))
+                rendered = len(dirty)
+        partial = filename + _partialSuffix
+        try:
+            os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+            if full:
+                nuke._writeScript(partial, lambda f: f.writelines(chunks))
+            with _saveLock:
+                if generation != _generation:
+                    # the script was saved, or another one opened, while this was written
+                    if full:
+                        os.remove(partial)
+                    return None
+                if full:
+                    os.replace(partial, filename)
+                    if os.path.exists(filename + _journalSuffix):
+                        os.remove(filename + _journalSuffix)
+                    _fullFile, _fullStructure, _fullSize, _journalSize = filename, structure, chunks.size(), 0
+                elif chunks:
+                    with open(filename + _journalSuffix, "a", encoding="utf-8", errors="surrogateescape") as f:
+                        f.writelines(chunks)
+                    _journalSize += chunks.size()
+                _savedVersion = version
+                _pendingSince = None
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            # the changes are written with the next autosave, which has to be a full one
+            with nuke._graphLock, _saveLock:
+                if generation == _generation:
+                    for node in dirty:
+                        if node._parent is not None or node is nuke.root():
+                            nuke._dirtyNodes[node] = None
+                    _fullFile = None
+            raise
+        _stats["full" if full else "journal"] += 1
+        _stats["nodesWritten"] += rendered
+        _stats["seconds"] += time.perf_counter() - start
+        return filename
+
+def _reset() -> None:
+    """Forget the last autosave, the next one is a full one. A save being written is dropped."""
+    with _saveLock:
+        _resetLocked()
+
+def _resetLocked() -> None:
+    global _savedVersion, _pendingSince, _fullFile, _generation
+    _generation += 1
+    _blocks.clear()
+    _fullFile = None
+    _savedVersion = nuke._scriptVersion
+    _pendingSince = None
+
+def restore(filename: str = None) -> bool:
+    """
+    Replace the current script with its autosave, the journal included. The script keeps its name and is marked modified.
+    Args:
+        filename (str): Optional. Autosave to restore, by default the one AutoSaveName gives. autoSaveRestoreFilter is called with it first.
+    Returns:
+        bool: True if an autosave was restored, False if autoSaveRestoreFilter returned None or the file does not exist.
+    """
+    filename = nuke.autoSaveRestoreFilter(filename or autoSaveName())
+    if not filename or not os.path.isfile(filename):
+        return False
+    with nuke._graphLock:
+        name = nuke.root()["name"].value()
+        nuke.scriptClear()
+        with open(filename, encoding="utf-8", errors="surrogateescape") as f:
+            nkscript.read(f, nuke.root())
+        journal = filename + _journalSuffix
+        if os.path.isfile(journal):
+            with open(journal, encoding="utf-8", errors="surrogateescape") as f:
+                for command in nkscript.commands(f):
+                    if len(command) != 3 or command[0] != "knobs":
+                        continue
+                    node = nuke.root() if command[1] == "root" else nuke.root().node(command[1])
+                    if node is not None:
+                        nkscript.readKnobs(node, command[2])
+        nuke.root().setName(name)
+        nuke._dirtyNodes.clear()
+        nuke.root().setModified(True)
+    _reset()
+    return True
+
+def offerRestore() -> bool:
+    """Ask the user whether to restore the autosave of the script being opened, if it is newer than the script. Returns True if it was restored."""
+    name = autoSaveName()
+    script = nuke.root()["name"].value()
+    if not name or not os.path.isfile(name):
+        return False
+    newest = max(os.path.getmtime(path) for path in (name, name + _journalSuffix) if os.path.isfile(path))
+    if os.path.isfile(script) and newest <= os.path.getmtime(script):
+        return False
+    if not nuke.ask(f"Autosave file {name} is more recent than the script. Load it instead?"):
+        return False
+    return restore(name)
+
+def delete() -> None:
+    """Remove the autosave of the current script and its journal, called once the script is saved. autoSaveDeleteFilter is called with the name first."""
+    name = autoSaveName()
+    filename = nuke.autoSaveDeleteFilter(name) if name else None
+    # with the lock held a save being written can not move its file in place after the removal
+    with _saveLock:
+        if filename:
+            for path in (filename, filename + _journalSuffix):
+                if os.path.isfile(path):
+                    os.remove(path)
+        _resetLocked()
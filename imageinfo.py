@@ -0,0 +1,323 @@
+# imageinfo.py
+#
+# Reads what a Read node needs to know about an image, the format, the
+# channels and the metadata, from the header of the file alone. OpenEXR
+# headers are parsed here in plain Python, single and multi-part, without
+# reading any pixel data. DPX, PNG, JPEG and TIFF give their size from a
+# fixed-size read at the start of the file, or a few seeks. Results are cached by path, size and mtime, so
+# every Read of the same file after the first costs a single stat.
+
+import functools
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+_exrMagic = 20000630
+_exrMultipart = 0x1000
+# bytes read at a time, headers of rendered EXRs are usually a few KB
+_chunkSize = 16384
+
+_compressions = ["none", "RLE", "Zip (1 scanline)", "Zip (16 scanlines)", "PIZ Wavelet (32 scanlines)", "PXR24", "B44", "B44A", "DWAA", "DWAB"]
+_lineOrders = ["INCREASING_Y", "DECREASING_Y", "RANDOM_Y"]
+_pixelTypes = ["32-bit uint", "16-bit half float", "32-bit float"]
+_channelNames = {"r": "red", "g": "green", "b": "blue", "a": "alpha"}
+
+class ImageInfo:
+    """What the header of an image says: format, channels in Nuke naming and metadata. Shared by every caller, do not modify."""
+    def __init__(self, width: int, height: int, pixelAspect: float = 1.0, channels: List[str] = None, metadata: Dict[str, object] = None):
+        self.width = width
+        self.height = height
+        self.pixelAspect = pixelAspect
+        self.channels = channels or []
+        self.metadata = metadata or {}
+
+class _HeaderReader:
+    """Reads a header a chunk at a time, large attributes like previews are skipped with a seek."""
+    def __init__(self, f):
+        self.f = f
+        self.buf = b""
+        self.pos = 0
+
+    def _fill(self, n: int) -> None:
+        while len(self.buf) - self.pos < n:
+            chunk = self.f.read(max(_chunkSize, n))
+            if not chunk:
+                raise ValueError("unexpected end of header")
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+
+    def take(self, n: int) -> bytes:
+        self._fill(n)
+        data = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return data
+
+    def skip(self, n: int) -> None:
+        available = len(self.buf) - self.pos
+        if n <= available:
+            self.pos += n
+        else:
+            self.f.seek(n - available, os.SEEK_CUR)
+            self.buf = b""
+            self.pos = 0
+
+    def cstring(self) -> bytes:
+        while True:
+            end = self.buf.find(b"\0", self.pos)
+            if end >= 0:
+                text = self.buf[self.pos:end]
+                self.pos = end + 1
+                return text
+            self._fill(len(self.buf) - self.pos + 1)
+
+def _chlist(data: bytes) -> List[Tuple[str, int]]:
+    channels = []
+    pos = 0
+    while pos < len(data) and data[pos]:
+        end = data.index(b"\0", pos)
+        name = data[pos:end].decode("utf-8", "replace")
+        pixelType = struct.unpack_from("<i", data, end + 1)[0]
+        channels.append((name, pixelType))
+        # pixel type, pLinear, 3 reserved bytes, x and y sampling
+        pos = end + 1 + 16
+    return channels
+
+def _stringVector(data: bytes) -> List[str]:
+    strings = []
+    pos = 0
+    while pos + 4 <= len(data):
+        n = struct.unpack_from("<i", data, pos)[0]
+        strings.append(data[pos + 4:pos + 4 + n].decode("utf-8", "replace"))
+        pos += 4 + n
+    return strings
+
+def _timecode(data: bytes) -> str:
+    bits = struct.unpack_from("<I", data)[0]
+    bcd = lambda shift, mask: (bits >> shift & 0xF) + 10 * (bits >> shift + 4 & mask)
+    return f"{bcd(24, 0x3):02d}:{bcd(16, 0x7):02d}:{bcd(8, 0x7):02d}:{bcd(0, 0x3):02d}"
+
+_attributeParsers = {
+    "int": lambda d: struct.unpack("<i", d)[0],
+    "float": lambda d: struct.unpack("<f", d)[0],
+    "double": lambda d: struct.unpack("<d", d)[0],
+    "string": lambda d: d.decode("utf-8", "replace"),
+    "stringvector": _stringVector,
+    "box2i": lambda d: list(struct.unpack("<4i", d)),
+    "box2f": lambda d: list(struct.unpack("<4f", d)),
+    "v2i": lambda d: list(struct.unpack("<2i", d)),
+    "v2f": lambda d: list(struct.unpack("<2f", d)),
+    "v3i": lambda d: list(struct.unpack("<3i", d)),
+    "v3f": lambda d: list(struct.unpack("<3f", d)),
+    "m33f": lambda d: list(struct.unpack("<9f", d)),
+    "m44f": lambda d: list(struct.unpack("<16f", d)),
+    "chromaticities": lambda d: list(struct.unpack("<8f", d)),
+    "rational": lambda d: (lambda n, m: n / m if m else 0.0)(*struct.unpack("<iI", d)),
+    "timecode": _timecode,
+    "keycode": lambda d: list(struct.unpack("<7i", d)),
+    "compression": lambda d: _compressions[d[0]] if d[0] < len(_compressions) else d[0],
+    "lineOrder": lambda d: _lineOrders[d[0]] if d[0] < len(_lineOrders) else d[0],
+    "chlist": _chlist,
+    "tiledesc": lambda d: list(struct.unpack("<2I", d[:8])),
+    "envmap": lambda d: d[0],
+    "deepImageState": lambda d: d[0],
+    "floatvector": lambda d: list(struct.unpack(f"<{len(d) // 4}f", d)),
+}
+
+def readExrHeader(path: str) -> List[Dict[str, object]]:
+    """
+    Read the headers of an OpenEXR file, one per part, without reading pixel data.
+    Args:
+        path (str): The file.
+    Returns:
+        List[Dict[str, object]]: Attributes of every part by name. Values of types that are not known, e.g. previews, are left out.
+    """
+    with open(path, "rb", buffering=0) as f:
+        return _exrHeaders(f, path)
+
+def _exrHeaders(f, path: str) -> List[Dict[str, object]]:
+    reader = _HeaderReader(f)
+    magic, version = struct.unpack("<ii", reader.take(8))
+    if magic != _exrMagic:
+        raise ValueError(f"{path} is not an OpenEXR file")
+    parts = []
+    while True:
+        header: Dict[str, object] = {}
+        while True:
+            name = reader.cstring()
+            if not name:
+                break
+            attributeType = reader.cstring().decode("ascii", "replace")
+            size = struct.unpack("<i", reader.take(4))[0]
+            parser = _attributeParsers.get(attributeType)
+            if parser is None:
+                reader.skip(size)
+                continue
+            try:
+                header[name.decode("utf-8", "replace")] = parser(reader.take(size))
+            except (struct.error, IndexError, ValueError):
+                pass
+        if not header:
+            break
+        parts.append(header)
+        if not version & _exrMultipart:
+            break
+    return parts
+
+def _nukeChannels(parts: List[Dict[str, object]]) -> List[str]:
+    """Channels in Nuke naming, `R` becomes `rgba.red` and `diffuse.R` becomes `diffuse.red`."""
+    channels = []
+    for part in parts:
+        partChannels = []
+        spl = []
+        for name, _ in part.get("channels", []):
+            spl = name.split(".")
+            if len(spl) == 1 and spl[0].lower() in _channelNames:
+                spl = ["rgba", spl[0]]
+            if len(spl) == 2:
+                spl[1] = _channelNames.get(spl[1].lower(), spl[1])
+            partChannels.append(".".join(spl))
+        # EXR sorts channels by name, A B G R, Nuke lists them as red green blue alpha
+        if spl and spl[0] == "rgba":
+            partChannels.reverse()
+        channels += partChannels
+    return channels
+
+def _inputMetadata(path: str, size: int, mtime: int, width: int, height: int, bits: str = None) -> Dict[str, object]:
+    metadata: Dict[str, object] = {
+        "input/filename": path,
+        "input/filesize": size,
+        "input/mtime": mtime // 1_000_000_000,
+        "input/width": width,
+        "input/height": height,
+    }
+    if bits:
+        metadata["input/bitsperchannel"] = bits
+    return metadata
+
+def _rgbChannels(alpha: bool) -> List[str]:
+    return ["rgba.red", "rgba.green", "rgba.blue"] + (["rgba.alpha"] if alpha else [])
+
+def _exrInfo(f, path: str, size: int, mtime: int) -> ImageInfo:
+    parts = _exrHeaders(f, path)
+    if not parts:
+        raise ValueError(f"{path} has no header")
+    header = parts[0]
+    # the data window, the area holding pixels, is left in the metadata
+    dx, dy, dr, dt = header.get("displayWindow", header.get("dataWindow", [0, 0, -1, -1]))
+    width, height = dr - dx + 1, dt - dy + 1
+    pixelTypes = {pixelType for _, pixelType in header.get("channels", [])}
+    bits = _pixelTypes[next(iter(pixelTypes))] if len(pixelTypes) == 1 and 0 <= next(iter(pixelTypes)) < len(_pixelTypes) else None
+    metadata = _inputMetadata(path, size, mtime, width, height, bits)
+    for name, value in header.items():
+        if name != "channels":
+            metadata["exr/" + name] = value
+    return ImageInfo(width, height, float(header.get("pixelAspectRatio", 1.0)), _nukeChannels(parts), metadata)
+
+def _dpxInfo(f, path: str, size: int, mtime: int) -> ImageInfo:
+    # the generic, image and orientation headers take the first 2048 bytes
+    header = f.read(2048)
+    if len(header) < 1636 or header[:4] not in (b"SDPX", b"XPDS"):
+        raise ValueError(f"{path} is not a DPX file")
+    order = ">" if header[:4] == b"SDPX" else "<"
+    width, height = struct.unpack_from(order + "II", header, 772)
+    descriptor, bits = header[800], header[803]
+    horizontal, vertical = struct.unpack_from(order + "II", header, 1628)
+    pixelAspect = horizontal / vertical if 0 < vertical < 0xFFFFFFFF and 0 < horizontal < 0xFFFFFFFF else 1.0
+    channels = ["rgba.alpha"] if descriptor == 4 else ["rgba.red"] if descriptor == 6 else _rgbChannels(descriptor in (51, 52))
+    return ImageInfo(width, height, pixelAspect, channels, _inputMetadata(path, size, mtime, width, height, f"{bits}-bit fixed"))
+
+def _pngInfo(f, path: str, size: int, mtime: int) -> ImageInfo:
+    header = f.read(26)
+    if len(header) < 26 or header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+        raise ValueError(f"{path} is not a PNG file")
+    width, height, bits, colorType = struct.unpack_from(">IIBB", header, 16)
+    channels = ["rgba.red"] if colorType == 0 else ["rgba.red", "rgba.alpha"] if colorType == 4 else _rgbChannels(colorType == 6)
+    return ImageInfo(width, height, 1.0, channels, _inputMetadata(path, size, mtime, width, height, f"{bits}-bit fixed"))
+
+# start of frame markers, the others carry tables and metadata
+_jpegFrameMarkers = frozenset([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+
+def _jpegInfo(f, path: str, size: int, mtime: int) -> ImageInfo:
+    reader = _HeaderReader(f)
+    if reader.take(2) != b"\xff\xd8":
+        raise ValueError(f"{path} is not a JPEG file")
+    while True:
+        marker = reader.take(2)
+        if marker[0] != 0xFF:
+            raise ValueError(f"{path} has no JPEG frame header")
+        if marker[1] == 0xFF:
+            # fill byte
+            reader.pos -= 1
+            continue
+        length = struct.unpack(">H", reader.take(2))[0]
+        if marker[1] in _jpegFrameMarkers:
+            bits, height, width, components = struct.unpack(">BHHB", reader.take(6))
+            channels = ["rgba.red"] if components == 1 else _rgbChannels(components == 4)
+            return ImageInfo(width, height, 1.0, channels, _inputMetadata(path, size, mtime, width, height, f"{bits}-bit fixed"))
+        # EXIF and ICC segments are skipped with a seek
+        reader.skip(length - 2)
+
+def _tiffInfo(f, path: str, size: int, mtime: int) -> ImageInfo:
+    header = f.read(8)
+    if header[:4] not in (b"II*\0", b"MM\0*"):
+        raise ValueError(f"{path} is not a TIFF file")
+    order = "<" if header[:2] == b"II" else ">"
+    f.seek(struct.unpack_from(order + "I", header, 4)[0])
+    count = struct.unpack(order + "H", f.read(2))[0]
+    entries = f.read(12 * count)
+    tags = {}
+    for i in range(count):
+        tag, fieldType, n = struct.unpack_from(order + "HHI", entries, 12 * i)
+        # SHORT and LONG values that fit are stored in the entry, the first one is enough here
+        if fieldType == 3:
+            tags[tag] = struct.unpack_from(order + "H", entries, 12 * i + 8)[0]
+        elif fieldType == 4:
+            tags[tag] = struct.unpack_from(order + "I", entries, 12 * i + 8)[0]
+    width, height = tags.get(256), tags.get(257)
+    if width is None or height is None:
+        raise ValueError(f"{path} has no image size")
+    samples = tags.get(277, 1)
+    # several bits per sample are stored elsewhere, the count of one value is in the entry
+    bits = tags.get(258) if samples == 1 else None
+    channels = ["rgba.red"] if samples == 1 else _rgbChannels(samples >= 4)
+    return ImageInfo(width, height, 1.0, channels, _inputMetadata(path, size, mtime, width, height, f"{bits}-bit" if bits else None))
+
+_readers = {
+    ".exr": _exrInfo,
+    ".dpx": _dpxInfo,
+    ".png": _pngInfo,
+    ".jpg": _jpegInfo,
+    ".jpeg": _jpegInfo,
+    ".tif": _tiffInfo,
+    ".tiff": _tiffInfo,
+}
+
+@functools.lru_cache(maxsize=1024)
+def _imageInfo(path: str, size: int, mtime: int) -> ImageInfo:
+    reader = _readers[os.path.splitext(path)[1].lower()]
+    with open(path, "rb", buffering=0) as f:
+        return reader(f, path, size, mtime)
+
+def imageInfo(path: str) -> Optional[ImageInfo]:
+    """
+    Format, channels and metadata of an EXR, DPX, PNG, JPEG or TIFF file, from its header. Cached until the size or mtime of the file change.
+    Args:
+        path (str): The file.
+    Returns:
+        ImageInfo: The header information, None if the file does not exist, is of another type or can not be read.
+    """
+    if os.path.splitext(path)[1].lower() not in _readers:
+        return None
+    try:
+        st = os.stat(path)
+        return _imageInfo(path, st.st_size, st.st_mtime_ns)
+    except (OSError, ValueError, struct.error, IndexError):
+        return None
+
+def cacheInfo():
+    """Hits and misses of the header cache, see functools.lru_cache."""
+    return _imageInfo.cache_info()
+
+def clearCache() -> None:
+    """Forget all cached headers."""
+    _imageInfo.cache_clear()
@@ -0,0 +1,646 @@
+# nkscript.py
+#
+# Reader and writer for .nk scripts.
+# A script is a Tcl program: every node is a `Class {knob value ...}` command
+# and the node graph is described with a stack, a node takes its inputs from
+# the top of the stack and is pushed back on it. `set N [stack 0]` and
+# `push $N` reuse a node as the input of several others.
+# The text is read a line at a time and only the current command is kept in
+# memory, so large scripts can be read from an open file. Writing streams the
+# nodes to the output the same way. Parsed scripts are cached on disk, see
+# readFile().
+
+from __future__ import annotations
+import hashlib, itertools, os, pickle, re, shutil, sys, tempfile
+from stat import S_ISDIR, S_ISREG, S_IWGRP, S_IWOTH
+from typing import Dict, Iterable, Iterator, List, MutableMapping, TextIO, Tuple, Type, Union
+import nuke
+
+_specialRe = re.compile(r'[{}"\\]')
+_braceRe = re.compile(r"[{}\\]")
+# one word: a braced word without nested braces, a quoted word, the start of a braced word with nested braces, or a bare word
+_wordRe = re.compile(r'\s*(?:\{([^{}\\]*)\}|"((?:[^"\\]|\\.)*)"|(\{)|((?:[^\s\\\[]+|\\.|\[[^\]]*\]|[\\\[])+))', re.S)
+_escapeRe = re.compile(r"\\(.)", re.S)
+_escapes = {"n": "\n", "t": "\t", "r": "\r"}
+
+# classes without a Python implementation whose nodes have no inputs
+_sourceClasses = frozenset([
+    "Constant", "CheckerBoard2", "ColorBars", "ColorWheel", "Input", "StickyNote", "BackdropNode",
+    "Camera", "Camera2", "Camera3", "Camera4", "Axis", "Axis2", "Axis3", "Axis4", "Light", "Light2", "Light3",
+    "ReadGeo", "ReadGeo2", "DeepRead", "Precomp",
+])
+# commands that are not nodes, every other `word {body}` command is a node
+_scriptCommands = frozenset(["push", "set", "end_group", "clone", "version", "define_window_layout_xml", "add_layer", "cut_paste_input"])
+# addUserKnob type ids
+_userKnobClasses = {
+    1: "String_Knob", 2: "File_Knob", 3: "Int_Knob", 4: "Enumeration_Knob", 6: "Boolean_Knob", 7: "Array_Knob",
+    12: "Format_Knob", 20: "Tab_Knob", 22: "PyScript_Knob", 26: "Text_Knob", 32: "Script_Knob",
+}
+# node classes made up for class names nuke does not implement
+_unknownClasses: Dict[str, Type[nuke.Node]] = {}
+
+def _unescape(s: str) -> str:
+    if "\\" not in s:
+        return s
+    return _escapeRe.sub(lambda m: _escapes.get(m.group(1), m.group(1)), s)
+
+def _closingBrace(text: str, start: int) -> int:
+    """Index of the brace closing the one at `start`, or the end of text if it is not closed."""
+    depth = 0
+    escaped = -1
+    for m in _braceRe.finditer(text, start):
+        i = m.start()
+        if i == escaped:
+            continue
+        c = m.group()
+        if c == "\\":
+            escaped = i + 1
+        elif c == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if not depth:
+                return i
+    return len(text)
+
+def words(text: str) -> List[str]:
+    """
+    Split a Tcl command into words. Braced words are taken literally, backslash escapes are replaced in other words.
+    Command substitutions like `[stack 0]` are not run, they are returned as text.
+    """
+    result = []
+    append = result.append
+    match = _wordRe.match
+    i = 0
+    while True:
+        m = match(text, i)
+        if m is None:
+            return result
+        kind = m.lastindex
+        if kind == 1:
+            append(m.group(1))
+            i = m.end()
+        elif kind == 3:
+            end = _closingBrace(text, m.start(3))
+            append(text[m.end(3):end])
+            i = end + 1
+        else:
+            append(_unescape(m.group(kind)))
+            i = m.end()
+
+def _balance(line: str, depth: int, quoted: bool):
+    """Brace depth and whether a quoted word is still open after `line`. Braces inside quotes and quotes inside braces do not count, as in Tcl."""
+    if depth > 0 and "{" not in line and "}" not in line and "\\" not in line:
+        return depth, quoted
+    escaped = -1
+    for m in _specialRe.finditer(line):
+        i = m.start()
+        if i == escaped:
+            continue
+        c = m.group()
+        if c == "\\":
+            escaped = i + 1
+        elif quoted:
+            if c == '"':
+                quoted = False
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+        elif not depth:
+            quoted = True
+    return depth, quoted
+
+def commands(lines: Iterable[str]) -> Iterator[List[str]]:
+    """
+    Split script text into commands, each as a list of words. Comment lines are skipped.
+    Args:
+        lines (Iterable[str]): Lines of the script, e.g. an open file.
+    """
+    parts = []
+    depth = 0
+    quoted = False
+    for line in lines:
+        if not parts:
+            stripped = line.lstrip()
+            if not stripped or stripped[0] == "#":
+                continue
+        depth, quoted = _balance(line, depth, quoted)
+        parts.append(line)
+        if depth <= 0 and not quoted:
+            text = "".join(parts)
+            parts = []
+            depth = 0
+            yield words(text)
+    if parts:
+        yield words("".join(parts))
+
+def parsedCommands(commands: Iterable[List[str]]) -> Iterator[list]:
+    """Commands with the bodies of node commands split into `[name, value, ...]` lists, which is what the reader and the script cache work on."""
+    intern = sys.intern
+    for items in commands:
+        if len(items) == 2 and items[0] not in _scriptCommands:
+            body = words(items[1])
+            # knob names repeat in every node, interning them also keeps the cache small
+            body[::2] = [intern(name) for name in body[::2]]
+            yield [items[0], body]
+        else:
+            yield items
+
+def _nodeClass(name: str) -> Type[nuke.Node]:
+    cls = nuke._nodeClasses.get(name)
+    if cls is None:
+        cls = _unknownClasses.get(name)
+        if cls is None:
+            cls = _unknownClasses[name] = type(name, (nuke.Node,), {"_scriptInputs": 0 if name in _sourceClasses else 1})
+    return cls
+
+def _addUserKnob(node: nuke.Node, definition: str) -> None:
+    """Add the knob described by an `addUserKnob {type name options...}` command to node."""
+    items = words(definition)
+    if len(items) < 2:
+        return
+    className = _userKnobClasses.get(int(items[0])) if items[0].isdigit() else None
+    knob = getattr(nuke, className)(items[1]) if className else nuke.Knob(items[1])
+    options = items[2:]
+    i = 0
+    while i < len(options):
+        option = options[i]
+        if option[:1] in "+-" and len(option) > 1:
+            i += 1
+            continue
+        value = options[i + 1] if i + 1 < len(options) else ""
+        if option == "l":
+            knob._label = value
+        elif option == "t":
+            knob.setTooltip(value)
+        elif option == "M" and isinstance(knob, nuke.Enumeration_Knob):
+            knob.setValues(words(value))
+        elif option == "T":
+            knob.setValue(value)
+        i += 3 if option == "R" else 2
+    node.addKnob(knob)
+    knob.setFlag(nuke.WRITE_USER_KNOB_DEFS)
+    # written back as it was read, with the options not handled here
+    knob._scriptDefinition = definition
+
+def readKnobs(node: nuke.Node, body: Union[str, List[str]]) -> int:
+    """Set the knobs listed in a node's body, the text or its words, and return the number of inputs it takes."""
+    items = words(body) if isinstance(body, str) else body
+    inputs = node._scriptInputs
+    for i in range(0, len(items) - 1, 2):
+        name, value = items[i], items[i + 1]
+        if name == "inputs":
+            # masked nodes write e.g. `inputs 2+1`
+            counts = [int(n) for n in value.split("+") if n.isdigit()]
+            inputs = sum(counts)
+            if len(counts) == 2:
+                node._scriptMaskInputs = (counts[0], counts[1])
+        elif name == "name":
+            if isinstance(node, nuke.Root):
+                node.setName(value)
+            elif value != node.name():
+                group = node._parent if node._parent is not None else nuke.thisGroup()
+                node.setName(value, uncollide=value in group._nodesByName)
+        elif name == "addUserKnob":
+            _addUserKnob(node, value)
+        else:
+            knob = node._data.get(name)
+            if knob is None:
+                # a knob the Python node does not implement, kept so that saving writes it back
+                knob = nuke.Knob(name)
+                node.addKnob(knob)
+                knob.clearFlag(nuke.WRITE_USER_KNOB_DEFS)
+            knob.fromScript(value)
+    return inputs
+
+class _ScriptReader:
+    """Builds the nodes of a script from its commands."""
+    def __init__(self, group: nuke.Group):
+        self.group = group
+        self.stack: List[nuke.Node] = []
+        self.variables: Dict[str, nuke.Node] = {}
+        # node stacks of the groups enclosing the current one
+        self.outerStacks: List[List[nuke.Node]] = []
+        self.nodes: List[nuke.Node] = []
+
+    def run(self, commands: Iterable[list]) -> None:
+        self.group.begin()
+        try:
+            for items in commands:
+                command = items[0]
+                if command == "push":
+                    self.push(items[1] if len(items) > 1 else "0")
+                elif command == "set":
+                    if len(items) > 2:
+                        self.variables[items[1]] = self.stack[-1] if self.stack else None
+                elif command == "end_group":
+                    self.endGroup()
+                elif command == "clone":
+                    # clones are not supported, keep the stack in step
+                    self.stack.append(None)
+                elif len(items) == 2 and command not in _scriptCommands:
+                    self.node(command, items[1])
+        finally:
+            while self.outerStacks:
+                self.endGroup()
+            self.group.end()
+
+    def push(self, arg: str) -> None:
+        self.stack.append(self.variables.get(arg[1:]) if arg.startswith("$") else None)
+
+    def endGroup(self) -> None:
+        group = nuke.thisGroup()
+        if not self.outerStacks or group is self.group:
+            return
+        group.end()
+        self.stack = self.outerStacks.pop()
+        self.stack.append(group)
+
+    def node(self, nodeClass: str, body: Union[str, List[str]]) -> None:
+        if nodeClass == "Root":
+            readKnobs(nuke.root(), body)
+            return
+        node = nuke._newNode(_nodeClass(nodeClass), nuke.thisGroup(), userCreate=False)
+        self.nodes.append(node)
+        inputs = readKnobs(node, body)
+        for i in range(inputs):
+            upstream = self.stack.pop() if self.stack else None
+            if upstream is not None:
+                node.setInput(i, upstream)
+        if isinstance(node, nuke.Group):
+            self.outerStacks.append(self.stack)
+            self.stack = []
+            node.begin()
+        else:
+            self.stack.append(node)
+
+def read(lines: Iterable[str], group: nuke.Group = None) -> List[nuke.Node]:
+    """
+    Build the nodes of a script. They are created in one nuke.batch(), onCreate callbacks run for them but onUserCreate does not.
+    Args:
+        lines (Iterable[str]): Lines of the script, e.g. an open file.
+        group (Group): Optional. Group to create the nodes in, the current group by default.
+    Returns:
+        List[Node]: The nodes created, in script order.
+    """
+    return _build(parsedCommands(commands(lines)), group)
+
+def readFile(path: str, group: nuke.Group = None) -> List[nuke.Node]:
+    """Like read() for a file. The parsed commands come from the script cache when the file has not changed since it was cached."""
+    return _build(_fileCommands(os.path.abspath(path)), group)
+
+def _build(commands: Iterable[list], group: nuke.Group = None) -> List[nuke.Node]:
+    reader = _ScriptReader(group if group is not None else nuke.thisGroup())
+    with nuke.batch():
+        reader.run(commands)
+    return reader.nodes
+
+# Script cache.
+# Parsed commands of the scripts read with readFile() are pickled to
+# $NUKE_TEMP_DIR/scriptcache, one file per script path: a header with the
+# cache version, path, mtime, size and content hash of the script, then the
+# commands in chunks and None at the end. A script whose mtime changed but
+# whose content hash did not is still a hit, and its header gets the new
+# mtime. Cache files are unpickled, so the directory and every cache file
+# must be owned by the current user and not writable by anyone else, a file
+# is checked once it is open, right before it is loaded. A truncated or
+# corrupt cache file is removed and the script is parsed from where the file
+# ended. The least recently used files are removed once the cache is larger
+# than $NUKE_SCRIPT_CACHE_SIZE (MB, default 1024, 0 turns the cache off).
+
+_cacheVersion = 1
+_cacheChunkSize = 4096
+_cacheStats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+def _cacheDirectory() -> str:
+    return os.path.join(os.environ.get("NUKE_TEMP_DIR", tempfile.gettempdir()), "scriptcache")
+
+def _cacheLimit() -> int:
+    try:
+        return int(float(os.environ.get("NUKE_SCRIPT_CACHE_SIZE", 1024)) * 1024 * 1024)
+    except ValueError:
+        return 0
+
+def _cacheFile(path: str) -> str:
+    name = hashlib.blake2b(path.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest()
+    return os.path.join(_cacheDirectory(), name + ".pickle")
+
+def _private(st: os.stat_result) -> bool:
+    """True if a file or directory is owned by the current user and nobody else can write to it."""
+    return not hasattr(os, "getuid") or st.st_uid == os.getuid() and not st.st_mode & (S_IWGRP | S_IWOTH)
+
+def _cacheDirectoryTrusted(directory: str) -> bool:
+    """Only a directory, not a link to one, that is private to the current user is used."""
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.lstat(directory)
+    except OSError:
+        return False
+    return S_ISDIR(st.st_mode) and _private(st)
+
+def _contentHash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(nuke._scriptBufferSize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _openCache(cacheFile: str, header: dict):
+    """The cache file positioned after its header if it holds the commands of the script described by `header`, else None."""
+    try:
+        f = open(cacheFile, "rb")
+    except OSError:
+        return None
+    try:
+        # the file that was opened, the directory may have changed since it was checked
+        st = os.fstat(f.fileno())
+        if not S_ISREG(st.st_mode) or not _private(st):
+            f.close()
+            return None
+        stored = pickle.load(f)
+        if stored.get("version") == _cacheVersion and stored.get("path") == header["path"] and stored.get("size") == header["size"]:
+            if stored.get("mtime") == header["mtime"]:
+                # the mtime is the last use for the LRU eviction
+                os.utime(cacheFile)
+                return f
+            if stored.get("hash") == _contentHash(header["path"]):
+                # the script was touched but not changed, with its new mtime in the header the next open skips the hash
+                start = f.tell()
+                try:
+                    _rewriteHeader(f, cacheFile, dict(stored, mtime=header["mtime"]))
+                except OSError:
+                    os.utime(cacheFile)
+                f.seek(start)
+                return f
+    except Exception:
+        pass
+    f.close()
+    return None
+
+def _rewriteHeader(f, cacheFile: str, header: dict) -> None:
+    """Replace the cache file with one that has `header` and the commands of `f`, which is positioned after the old header."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cacheFile), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            pickle.dump(header, out, pickle.HIGHEST_PROTOCOL)
+            shutil.copyfileobj(f, out)
+        os.replace(tmp, cacheFile)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+def _cachedCommands(f, cacheFile: str, path: str) -> Iterator[list]:
+    """Commands of a cache file. If it turns out truncated or corrupt it is removed, and the commands it did not have are parsed from the script."""
+    count = 0
+    with f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except Exception:
+                break
+            if chunk is None:
+                return
+            yield from chunk
+            count += len(chunk)
+    try:
+        os.unlink(cacheFile)
+        _cacheStats["evictions"] += 1
+    except OSError:
+        pass
+    with open(path, encoding="utf-8", errors="surrogateescape", buffering=nuke._scriptBufferSize) as script:
+        yield from itertools.islice(parsedCommands(commands(script)), count, None)
+
+def _fileCommands(path: str) -> Iterator[list]:
+    """Parsed commands of the script at path, from the cache if possible. Parsed commands are written to the cache while they are read."""
+    stat = os.stat(path)
+    header = {"version": _cacheVersion, "path": path, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+    directory = _cacheDirectory()
+    limit = _cacheLimit()
+    if limit <= 0 or not _cacheDirectoryTrusted(directory):
+        with open(path, encoding="utf-8", errors="surrogateescape", buffering=nuke._scriptBufferSize) as f:
+            yield from parsedCommands(commands(f))
+        return
+    cacheFile = _cacheFile(path)
+    cached = _openCache(cacheFile, header)
+    if cached is not None:
+        _cacheStats["hits"] += 1
+        yield from _cachedCommands(cached, cacheFile, path)
+        return
+    _cacheStats["misses"] += 1
+    header["hash"] = _contentHash(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out, open(path, encoding="utf-8", errors="surrogateescape", buffering=nuke._scriptBufferSize) as f:
+            pickle.dump(header, out, pickle.HIGHEST_PROTOCOL)
+            chunk = []
+            for command in parsedCommands(commands(f)):
+                chunk.append(command)
+                if len(chunk) == _cacheChunkSize:
+                    pickle.dump(chunk, out, pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+                yield command
+            pickle.dump(chunk, out, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(None, out, pickle.HIGHEST_PROTOCOL)
+        stat = os.stat(path)
+        if (stat.st_mtime_ns, stat.st_size) == (header["mtime"], header["size"]):
+            os.replace(tmp, cacheFile)
+            _cacheStats["writes"] += 1
+            _evictCache(directory, limit)
+        else:
+            # changed while it was read
+            os.unlink(tmp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+def _cacheEntries(directory: str) -> List[Tuple[float, int, str]]:
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(".pickle"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        pass
+    return entries
+
+def _evictCache(directory: str, limit: int) -> None:
+    entries = _cacheEntries(directory)
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        _cacheStats["evictions"] += 1
+
+def cacheStats() -> dict:
+    """Hits, misses, writes and evictions of the script cache in this session, with the number of cache files and their size in bytes."""
+    entries = _cacheEntries(_cacheDirectory())
+    return dict(_cacheStats, entries=len(entries), size=sum(size for _, size, _ in entries))
+
+def clearCache() -> None:
+    """Remove all script cache files."""
+    for _, _, path in _cacheEntries(_cacheDirectory()):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+_bareWordRe = re.compile(r'[^\s{}"\\\[\]$;]+\Z')
+_quoteRe = re.compile(r'[\\"\[\]${}\n\t\r]')
+_quoteEscapes = {"\n": "\\n", "\t": "\\t", "\r": "\\r"}
+_userKnobTypes = {className: typeId for typeId, className in _userKnobClasses.items()}
+
+def _bracesBalanced(text: str) -> bool:
+    if "\\" in text:
+        return False
+    depth = 0
+    for c in _braceRe.findall(text):
+        depth += 1 if c == "{" else -1
+        if depth < 0:
+            return False
+    return not depth
+
+def quote(text: str, braced: bool = False) -> str:
+    """
+    Tcl word for text, as words are written in scripts.
+    Args:
+        text (str): The text.
+        braced (bool): Optional. Put text that is not a simple word in braces if possible, as used for expressions and animations, instead of quotes.
+    """
+    if _bareWordRe.match(text):
+        return text
+    if braced and _bracesBalanced(text):
+        return "{" + text + "}"
+    return '"' + _quoteRe.sub(lambda m: _quoteEscapes.get(m.group(), "\\" + m.group()), text) + '"'
+
+def _userKnobDefinition(knob: nuke.Knob) -> str:
+    definition = getattr(knob, "_scriptDefinition", None)
+    if definition is not None:
+        return definition
+    typeId = next((_userKnobTypes[c.__name__] for c in type(knob).__mro__ if c.__name__ in _userKnobTypes), 1)
+    parts = [str(typeId), quote(knob.name())]
+    if knob.label() != knob.name():
+        parts += ["l", quote(knob.label())]
+    if knob.tooltip():
+        parts += ["t", quote(knob.tooltip())]
+    if isinstance(knob, nuke.Enumeration_Knob):
+        parts += ["M", "{" + " ".join(quote(item) for item in knob.values()) + "}"]
+    return " ".join(parts)
+
+def knobItems(node: nuke.Node, flags: int = nuke.WRITE_NON_DEFAULT_ONLY | nuke.WRITE_USER_KNOB_DEFS) -> Iterator[Tuple[str, str]]:
+    """(name, Tcl word) of the knobs of node to write with Node.writeKnobs() flags. Knobs flagged DO_NOT_WRITE are skipped, the name is always written."""
+    writeAll = not flags & nuke.WRITE_NON_DEFAULT_ONLY or flags & nuke.WRITE_ALL
+    for name, knob in node._data.items():
+        knobFlags = knob._flag
+        if knobFlags & nuke.DO_NOT_WRITE:
+            continue
+        if knobFlags & nuke.WRITE_USER_KNOB_DEFS and flags & nuke.WRITE_USER_KNOB_DEFS:
+            yield "addUserKnob", "{" + _userKnobDefinition(knob) + "}"
+        if writeAll or knobFlags & nuke.WRITE_ALL or name == "name" or knob.notDefault():
+            yield name, knob.toScript(quote=True)
+
+def _inputCount(node: nuke.Node) -> int:
+    """Number of inputs a node takes from the stack when written, a masked node keeps at least the inputs it was read with."""
+    if node._scriptMaskInputs is not None:
+        return max(node.inputs(), sum(node._scriptMaskInputs))
+    return node.inputs()
+
+class _ScriptWriter:
+    """
+    Writes nodes as script commands. Every node is written as soon as its commands are known, the script is never built as one string.
+    With `blocks`, the text of every node is kept there and reused while the node is in it, callers remove the nodes that changed.
+    """
+    def __init__(self, out: TextIO, blocks: MutableMapping = None):
+        self.out = out
+        self.blocks = blocks
+        # stack variables of pushed nodes, numbered in the order they are set so names are unique and repeatable
+        self.variables: Dict[nuke.Node, str] = {}
+
+    def variable(self, node: nuke.Node) -> str:
+        name = self.variables.get(node)
+        if name is None:
+            name = self.variables[node] = f"N{len(self.variables) + 1:x}"
+        return name
+
+    def group(self, group: nuke.Group, indent: str) -> None:
+        """Write the nodes of group, inputs before the nodes using them. Stack positions are worked out first so only nodes pushed again later get a variable."""
+        commands = []
+        pushed = set()
+        stack = []
+        for node in group._topologicalOrder():
+            inputs = [node._inputs.get(i) for i in range(_inputCount(node))]
+            inputs = [upstream if upstream is None or upstream._parent is group else None for upstream in inputs]
+            missing = inputs
+            # the previous node is still on top of the stack, it is the last input if nothing else is pushed
+            if inputs and inputs[-1] is not None and stack and stack[-1] is inputs[-1]:
+                stack.pop()
+                missing = inputs[:-1]
+            for upstream in reversed(missing):
+                commands.append(("push", upstream))
+                if upstream is not None:
+                    pushed.add(upstream)
+            # the node takes the pushed inputs and is pushed itself
+            commands.append(("node", node, len(inputs)))
+            stack.append(node)
+        write = self.out.write
+        for command in commands:
+            if command[0] == "push":
+                write(f"{indent}push ${self.variable(command[1])}\n" if command[1] is not None else f"{indent}push 0\n")
+                continue
+            node = command[1]
+            self.node(node, command[2], indent)
+            if isinstance(node, nuke.Group):
+                self.group(node, indent + " ")
+                write(f"{indent}end_group\n")
+            if node in pushed:
+                write(f"{indent}set {self.variable(node)} [stack 0]\n")
+
+    def node(self, node: nuke.Node, inputs: int, indent: str) -> None:
+        if self.blocks is not None:
+            cached = self.blocks.get(node)
+            if cached is not None and cached[0] == inputs and cached[1] == indent:
+                self.out.write(cached[2])
+                return
+        lines = [f"{indent}{node.Class()} {{\n"]
+        if node._scriptMaskInputs is not None:
+            masks = node._scriptMaskInputs[1]
+            lines.append(f"{indent} inputs {inputs - masks}+{masks}\n")
+        elif inputs != node._scriptInputs:
+            lines.append(f"{indent} inputs {inputs}\n")
+        lines.extend(f"{indent} {name} {value}\n" for name, value in knobItems(node))
+        lines.append(f"{indent}}}\n")
+        text = "".join(lines)
+        if self.blocks is not None:
+            self.blocks[node] = (inputs, indent, text)
+        self.out.write(text)
+
+def write(out: TextIO, group: nuke.Group = None, blocks: MutableMapping = None) -> None:
+    """
+    Write the nodes of a group as a script, in the same order every time so saved scripts can be diffed.
+    Only knobs that are not at their defaults are written. The root group is written as a whole script, with the Root knobs.
+    Args:
+        out (TextIO): Output, e.g. an open file.
+        group (Group): Optional. Group to write, the root by default.
+        blocks (MutableMapping): Optional. Node texts from earlier writes, see _ScriptWriter.
+    """
+    if group is None:
+        group = nuke.root()
+    writer = _ScriptWriter(out, blocks)
+    if group is nuke.root():
+        out.write(f"#! nuke -nx\nversion {nuke.NUKE_VERSION_MAJOR}.{nuke.NUKE_VERSION_MINOR} v{nuke.NUKE_VERSION_RELEASE}\n")
+        writer.node(group, 0, "")
+        writer.group(group, "")
+    else:
+        writer.group(group, "")
@@ -1,20 +1,72 @@
+from __future__ import annotations
+import time
+_importStart = time.perf_counter()
+
 from variables import *
-from typing import overload, Any, Union, List, Dict, Callable, Literal, Type, Optional
-import os, re, sys, tempfile
-from tcl import tcl
+from typing import overload, Any, Union, List, Dict, Callable, Literal, Type, Optional, Iterator, Iterable, Tuple, TextIO, TYPE_CHECKING
+import os, re, sys, io, tempfile, heapq, bisect, weakref, contextlib, threading, collections
+from tcl import tcl, evaluate as _evaluate, substitute as _substitute
+import nkscript
+import autosave
+import imageinfo
 from callbacks import *
-from ocio_aces12_colorspaces import colorspaces_list
 
-try:
+if TYPE_CHECKING:
     from PySide2.QtWidgets import QApplication, QLineEdit, QCheckBox, QComboBox, QPlainTextEdit, QLabel, QWidget, QWidgetItem, QPushButton
-    from PySide2.QtGui import QIntValidator
-except ImportError:
-    from PySide6.QtWidgets import QApplication, QLineEdit, QCheckBox, QComboBox, QPlainTextEdit, QLabel, QWidget, QWidgetItem, QPushButton
-    from PySide6.QtGui import QIntValidator
+    from PySide2.QtCore import QStringListModel
+
+# Qt, the Tcl interpreter and the OCIO tables are loaded on first use, startupReport() shows what each one cost
+_startupTimes: Dict[str, float] = {}
+_qtNames = ("QApplication", "QLineEdit", "QCheckBox", "QComboBox", "QPlainTextEdit", "QLabel", "QWidget", "QWidgetItem", "QPushButton", "QIntValidator", "QStringListModel")
+_qtLoaded = False
+
+def _loadQt() -> None:
+    """Import PySide and create the QApplication. Called before the first widget or panel is built."""
+    global _qtLoaded, app, QApplication, QLineEdit, QCheckBox, QComboBox, QPlainTextEdit, QLabel, QWidget, QWidgetItem, QPushButton, QIntValidator, QStringListModel
+    if _qtLoaded:
+        return
+    start = time.perf_counter()
+    try:
+        from PySide2.QtWidgets import QApplication, QLineEdit, QCheckBox, QComboBox, QPlainTextEdit, QLabel, QWidget, QWidgetItem, QPushButton
+        from PySide2.QtGui import QIntValidator
+        from PySide2.QtCore import QStringListModel
+    except ImportError:
+        from PySide6.QtWidgets import QApplication, QLineEdit, QCheckBox, QComboBox, QPlainTextEdit, QLabel, QWidget, QWidgetItem, QPushButton
+        from PySide6.QtGui import QIntValidator
+        from PySide6.QtCore import QStringListModel
+    app = QApplication.instance() or QApplication(sys.argv)
+    _qtLoaded = True
+    _startupTimes["Qt"] = time.perf_counter() - start
+
+def __getattr__(name: str):
+    if name == "app" or name in _qtNames:
+        _loadQt()
+        return globals()[name]
+    if name == "colorspaces_list":
+        return _colorspaces()
+    raise AttributeError(f"module 'nuke' has no attribute '{name}'")
+
+def _colorspaces() -> List[str]:
+    if "ocio_aces12_colorspaces" not in sys.modules:
+        start = time.perf_counter()
+        import ocio_aces12_colorspaces
+        _startupTimes["OCIO"] = time.perf_counter() - start
+    return sys.modules["ocio_aces12_colorspaces"].colorspaces_list
+
+def startupReport() -> str:
+    """
+    Time spent importing this module and loading the lazily initialised parts, one `name: milliseconds` line each.
+    Parts that were never used are not listed.
+    """
+    return "\n".join(f"{name}: {seconds * 1000:.1f} ms" for name, seconds in _startupTimes.items())
+
+# Terminal mode, like `nuke -t`
+if os.environ.get("NUKE_DEBUG_TERMINAL", "0") not in ("", "0"):
+    GUI = False
+    INTERACTIVE = False
 
 os.environ["NUKE_TEMP_DIR"] = os.path.join(tempfile.gettempdir(), "nuke").replace("\\", "/")
 
-app = QApplication(sys.argv)
 
 _pluginPath: List[str] = [os.path.expanduser("~/.nuke").replace("\\", "/")]
 
@@ -227,27 +279,279 @@ class Format:
         """Return the bottom edge of image file in pixels."""
         return self._y
 
+# frame ranges in Nuke's syntax: `first`, `first-last` or `first-lastxstep`, separated by spaces or commas
+_frameRangeRe = re.compile(r"\s*(-?\d+)(?:-(-?\d+)(?:[x/](\d+))?)?\s*(?:,|\s|$)")
+
+def _compactFrames(frames: Iterable[int]) -> List[Tuple[int, int, int]]:
+    """Runs `(first, last, step)` of sorted unique frames. Contiguous frames are preferred, three or more evenly spaced single frames make a stepped run."""
+    runs: List[Tuple[int, int, int]] = []
+    for frame in frames:
+        if runs:
+            first, last, step = runs[-1]
+            if frame - last == step and (first != last or step == 1):
+                runs[-1] = (first, frame, step)
+                continue
+            if first == last and len(runs) > 1:
+                previous = runs[-2]
+                if previous[0] == previous[1] and frame - last == last - previous[1]:
+                    runs[-2:] = [(previous[1], frame, frame - last)]
+                    continue
+        runs.append((frame, frame, 1))
+    return runs
+
+class FrameRanges:
+    """
+    A set of frames, stored as sorted runs `(first, last, step)` that do not overlap, so sequences with millions of frames take a few tuples.
+    Written and read as Nuke frame ranges, e.g. `1-10 12-20 1-100x2`. Membership is a binary search over the runs.
+    """
+    def __init__(self, ranges: Union[str, "FrameRanges", Iterable] = None):
+        """
+        Args:
+            ranges: Optional. A range string like `1-10 12-20x2`, another FrameRanges, or an iterable of range strings, frame numbers and `(first, last[, step])` tuples.
+        """
+        self._runs: List[Tuple[int, int, int]] = []
+        self._firsts: List[int] = []
+        self._lasts: List[int] = []
+        if ranges is not None:
+            self.add(ranges)
+
+    @classmethod
+    def fromFrames(cls, frames: Iterable[int]) -> "FrameRanges":
+        """Frame ranges holding the frame numbers, in any order."""
+        ranges = cls()
+        ranges._setRuns(_compactFrames(sorted(set(frames))))
+        return ranges
+
+    def _setRuns(self, runs: List[Tuple[int, int, int]]) -> None:
+        self._runs = runs
+        self._firsts = [run[0] for run in runs]
+        self._lasts = [run[1] for run in runs]
+
+    def add(self, ranges: Union[str, "FrameRanges", Iterable, int]) -> None:
+        """Add frames, given like to the constructor or as a single frame number."""
+        if isinstance(ranges, int):
+            self.addRange(ranges, ranges)
+        elif isinstance(ranges, str):
+            pos = 0
+            while pos < len(ranges):
+                m = _frameRangeRe.match(ranges, pos)
+                if m is None or m.end() == pos:
+                    if ranges[pos:].strip():
+                        raise ValueError(f"Bad frame range '{ranges}'")
+                    break
+                first = int(m.group(1))
+                last = int(m.group(2)) if m.group(2) is not None else first
+                self.addRange(first, last, int(m.group(3) or 1))
+                pos = m.end()
+        elif isinstance(ranges, FrameRanges):
+            if not self._runs:
+                self._setRuns(list(ranges._runs))
+            else:
+                for run in ranges._runs:
+                    self.addRange(*run)
+        elif isinstance(ranges, tuple) and ranges and all(isinstance(i, int) for i in ranges):
+            self.addRange(*ranges)
+        else:
+            for item in ranges:
+                self.add(item)
+
+    def addRange(self, first: int, last: int, increment: int = 1) -> None:
+        """Add the frames from first to last, every increment frames."""
+        if increment < 1:
+            raise ValueError("increment must be positive")
+        if last < first:
+            first, last = last, first
+        last -= (last - first) % increment
+        if first == last:
+            increment = 1
+        # runs touching the new one, or overlapping it, are merged with it
+        i = bisect.bisect_left(self._lasts, first - 1)
+        j = bisect.bisect_right(self._firsts, last + 1)
+        run = (first, last, increment)
+        if i == j:
+            self._runs.insert(i, run)
+            self._firsts.insert(i, first)
+            self._lasts.insert(i, last)
+            return
+        group = self._runs[i:j] + [run]
+        lo = min(first, self._firsts[i])
+        hi = max(last, self._lasts[j - 1])
+        steps = {step for _, _, step in group}
+        if steps == {1}:
+            merged = [(lo, hi, 1)]
+        elif len(steps) == 1 and len({f % increment for f, _, _ in group}) == 1 and self._chained(sorted(group), increment):
+            merged = [(lo, hi, increment)]
+        else:
+            frames = set()
+            for f, l, step in group:
+                frames.update(range(f, l + 1, step))
+            merged = _compactFrames(sorted(frames))
+        self._runs[i:j] = merged
+        self._firsts[i:j] = [r[0] for r in merged]
+        self._lasts[i:j] = [r[1] for r in merged]
+
+    @staticmethod
+    def _chained(runs: List[Tuple[int, int, int]], step: int) -> bool:
+        last = runs[0][1]
+        for f, l, _ in runs[1:]:
+            if f > last + step:
+                return False
+            last = max(last, l)
+        return True
+
+    def clear(self) -> None:
+        """Remove all frames."""
+        self._setRuns([])
+
+    def compact(self) -> None:
+        """Runs are merged as frames are added, there is nothing left to compact."""
+
+    def isValid(self) -> bool:
+        """True if there is at least one frame."""
+        return bool(self._runs)
+
+    def size(self) -> int:
+        """Number of ranges."""
+        return len(self._runs)
+
+    def getRange(self, index: int) -> Tuple[int, int, int]:
+        """The range at index as `(first, last, step)`."""
+        return self._runs[index]
+
+    def ranges(self) -> List[Tuple[int, int, int]]:
+        """All ranges as `(first, last, step)`, in frame order."""
+        return list(self._runs)
+
+    def minFrame(self) -> Optional[int]:
+        """First frame, None if there are no frames."""
+        return self._runs[0][0] if self._runs else None
+
+    def maxFrame(self) -> Optional[int]:
+        """Last frame, None if there are no frames."""
+        return self._runs[-1][1] if self._runs else None
+
+    def toFrameList(self) -> List[int]:
+        """All frames, in order."""
+        return list(self)
+
+    def gaps(self) -> "FrameRanges":
+        """Frames between minFrame() and maxFrame() that are not in the set."""
+        result = FrameRanges()
+        runs = []
+        previous = None
+        for first, last, step in self._runs:
+            if previous is not None and first > previous + 1:
+                runs.append((previous + 1, first - 1, 1))
+            if step == 2:
+                runs.append((first + 1, last - 1, 2))
+            elif step > 2:
+                runs.extend((f + 1, f + step - 1, 1) for f in range(first, last, step))
+            previous = last
+        # gaps come out in frame order, addRange() merges the ones that touch
+        for run in runs:
+            result.addRange(*run)
+        return result
+
+    def union(self, other: Union["FrameRanges", str, Iterable]) -> "FrameRanges":
+        """Frames in either set."""
+        other = other if isinstance(other, FrameRanges) else FrameRanges(other)
+        small, large = sorted((self, other), key=lambda r: len(r._runs))
+        result = FrameRanges(large)
+        for run in small._runs:
+            result.addRange(*run)
+        return result
+
+    def intersection(self, other: Union["FrameRanges", str, Iterable]) -> "FrameRanges":
+        """Frames in both sets."""
+        other = other if isinstance(other, FrameRanges) else FrameRanges(other)
+        result = FrameRanges()
+        a, b = self._runs, other._runs
+        i = j = 0
+        while i < len(a) and j < len(b):
+            (f1, l1, s1), (f2, l2, s2) = a[i], b[j]
+            lo, hi = max(f1, f2), min(l1, l2)
+            if lo <= hi:
+                if s1 == 1 or s2 == 1:
+                    f, s = (f2, s2) if s1 == 1 else (f1, s1)
+                    first = f + -(-(lo - f) // s) * s
+                    last = f + (hi - f) // s * s
+                    if first <= last:
+                        result.addRange(first, last, s)
+                else:
+                    frames = [frame for frame in range(f1 + -(-(lo - f1) // s1) * s1, hi + 1, s1) if (frame - f2) % s2 == 0]
+                    for run in _compactFrames(frames):
+                        result.addRange(*run)
+            if l1 < l2:
+                i += 1
+            else:
+                j += 1
+        return result
+
+    __or__ = union
+    __and__ = intersection
+
+    def __contains__(self, frame: int) -> bool:
+        i = bisect.bisect_right(self._firsts, frame) - 1
+        if i < 0:
+            return False
+        first, last, step = self._runs[i]
+        return frame <= last and (frame - first) % step == 0
+
+    def __len__(self) -> int:
+        return sum((last - first) // step + 1 for first, last, step in self._runs)
+
+    def __iter__(self) -> Iterator[int]:
+        for first, last, step in self._runs:
+            yield from range(first, last + 1, step)
+
+    def __bool__(self) -> bool:
+        return bool(self._runs)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FrameRanges):
+            return NotImplemented
+        # the same frames can be stored as different runs, depending on the order they were added in
+        return self._runs == other._runs or len(self) == len(other) and all(x == y for x, y in zip(self, other))
+
+    __hash__ = None
+
+    def __str__(self) -> str:
+        return " ".join(_formatRun(first, last, step) for first, last, step in self._runs)
+
+    def __repr__(self) -> str:
+        return f"FrameRanges('{self}')"
+
+def _formatRun(first: int, last: int, step: int = 1) -> str:
+    if first == last:
+        return str(first)
+    return f"{first}-{last}" if step == 1 else f"{first}-{last}x{step}"
+
 class Knob:
     def __init__(self, name, label=None):
         self._name = name
         self._label = label if label else name
         self._value = None
+        # value when the knob was added to its node, knobs still at it are not written to scripts
+        self._default = None
         self._node = None
         self._flag = 0
+        # bumped on every change of the value, memoised evaluations of expressions reading the knob check it
+        self._version = 0
         self._tooltip: str = ""
         self._visible = True
         self._enabled = True
-        self._pyside_object: QWidget = QWidget()
+        self._pyside_object: QWidget = None
         self._pyside_object_label_item: QWidgetItem = None
         self._panel = None
 
     def setValue(self, val, chan=None) -> bool:
         """Sets the value `val` at channel `chan`."""
         self._value = val
+        self._changed()
         return True
     
     def value(self):
-        return self._value.split("\t\t\t")[0] if isinstance(self._value, str) else self._value
+        return self._value
 
     def getValue(self):
         return self.value()
@@ -261,17 +565,32 @@ class Knob:
     def node(self):
         return self._node
 
+    def fromScript(self, s: str) -> bool:
+        """Set the value from its text in a .nk script."""
+        self.setValue(s)
+        return True
+
+    def toScript(self, quote: bool = False, context=None) -> str:
+        """Return the value of the knob in script syntax. With `quote` it is a single Tcl word, as written in .nk files."""
+        text = "" if self._value is None else str(self._value)
+        # values read from braces in scripts, like the animations of knobs Python nodes do not implement, go back in braces
+        return nkscript.quote(text, braced=text.startswith("{")) if quote else text
+
+    def notDefault(self) -> bool:
+        """Returns True if the value is not the default."""
+        return self._value != self._default
+
     def clearAnimated(self) -> bool:
         """Clear animation for channel 'c'. Return True if successful."""
         return True
 
     def clearFlag(self, f):
-        self._flag = 0
+        """Clear flag."""
+        self._flag &= ~f
 
     def flag(self, f) -> bool:
-        """Returns whether the input flag is set.
-        TODO Reimplement to return bool value"""
-        return self._flag
+        """Returns whether the input flag is set."""
+        return bool(self._flag & f)
 
     def setEnabled(self, enabled) -> None:
         """
@@ -282,16 +601,19 @@ class Knob:
         self._enabled = enabled
 
     def setFlag(self, f):
-        self._flag = f
+        """Logical OR of the argument and existing knob flags."""
+        self._flag |= f
 
     def setTooltip(self, s: str) -> None:
         self._tooltip = s
-        self._pyside_object.setToolTip(s)
+        if self._pyside_object is not None:
+            self._pyside_object.setToolTip(s)
 
     def setVisible(self, visible: bool) -> None:
         """Show or hide the knob."""
         self._visible = visible
-        self._pyside_object.setVisible(visible)
+        if self._pyside_object is not None:
+            self._pyside_object.setVisible(visible)
         if self._pyside_object_label_item and self._pyside_object_label_item.widget():
             self._pyside_object_label_item.widget().setVisible(visible)
 
@@ -308,94 +630,282 @@ class Knob:
     def _setPanel(self, panel):
         self._panel = panel
 
+    def _changed(self) -> None:
+        """Record a change of the value, for autosave if the knob belongs to a node of the script."""
+        self._version += 1
+        node = self._node
+        if node is not None and (node is _root or getattr(node, "_parent", None) is not None):
+            _scriptChanged(node)
+
+    def _widget(self) -> QWidget:
+        """Qt widget of the knob. It is built on first use, i.e. when the knob is added to a panel, until then the value lives in plain Python state."""
+        if self._pyside_object is None:
+            _loadQt()
+            self._pyside_object = self._createWidget()
+            self._updateWidget()
+            if self._tooltip:
+                self._pyside_object.setToolTip(self._tooltip)
+            if not self._visible:
+                self._pyside_object.setVisible(False)
+        return self._pyside_object
+
+    def _createWidget(self) -> QWidget:
+        return QWidget()
+
+    def _updateWidget(self) -> None:
+        """Show the current value in the widget. Only called once the widget exists."""
+        pass
+
 class Format_Knob(Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
         self._value: Format = None
 
+    def fromScript(self, s: str) -> bool:
+        """Set the format from `w h x y r t pixelAspect name`, `w h pixelAspect name` or the name of a known format."""
+        parts = s.split()
+        name = parts.pop() if parts and not _isScriptNumber(parts[-1]) else ""
+        try:
+            numbers = [float(p) for p in parts]
+        except ValueError:
+            return False
+        if len(numbers) >= 6:
+            w, h, x, y, r, t = (int(n) for n in numbers[:6])
+            format = Format(w, h, x, y, r, t, numbers[6] if len(numbers) > 6 else 1.0)
+        elif len(numbers) >= 2:
+            w, h = int(numbers[0]), int(numbers[1])
+            format = Format(w, h, 0, 0, w, h, numbers[2] if len(numbers) > 2 else 1.0)
+        else:
+            format = next((f for f in formats() if name and f.name() == name), None)
+            if format is None:
+                return False
+        format.setName(name)
+        self.setValue(format)
+        return True
+
+    def toScript(self, quote: bool = False, context=None) -> str:
+        format = self._value
+        if format is None:
+            text = ""
+        else:
+            text = f"{format.width()} {format.height()} {format.x()} {format.y()} {format.r()} {format.t()} {_scriptNumberText(format.pixelAspect())} {format.name()}".rstrip()
+        return nkscript.quote(text) if quote else text
+
+def _imageFormat(info: imageinfo.ImageInfo) -> Format:
+    """Format of an image, named after the known format of the same size if there is one."""
+    format = Format(info.width, info.height, 0, 0, info.width, info.height, info.pixelAspect)
+    for known in formats():
+        if known is not None and (known.width(), known.height(), known.pixelAspect()) == (info.width, info.height, info.pixelAspect):
+            format.setName(known.name())
+            break
+    return format
+
+def _isScriptNumber(s: str) -> bool:
+    try:
+        float(s)
+    except ValueError:
+        return False
+    return True
+
+def _scriptNumber(s: str) -> Union[int, float]:
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+def _scriptNumberText(n) -> str:
+    if isinstance(n, float) and n.is_integer():
+        return str(int(n))
+    return str(n)
+
 class Array_Knob(Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
         self._value = 0.0
 
+    def fromScript(self, s: str) -> bool:
+        """Set the value from its text in a .nk script. Expressions and animations are kept as text."""
+        try:
+            return self.setValue(_scriptNumber(s)) is not False
+        except ValueError:
+            self._value = s
+            self._changed()
+            return True
+
+    def toScript(self, quote: bool = False, context=None) -> str:
+        value = self._value
+        if isinstance(value, str):
+            # expression or animation, written in braces
+            return nkscript.quote(value, braced=True) if quote else value
+        if isinstance(value, (list, tuple)):
+            text = " ".join(_scriptNumberText(v) for v in value)
+            return nkscript.quote(text, braced=True) if quote else text
+        return _scriptNumberText(value)
+
 class Int_Knob(Array_Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
         self._value: int = 0
-        self._pyside_object: QLineEdit = QLineEdit()
-        self._pyside_object.setValidator(QIntValidator())
     
     def setValue(self, val: int) -> bool:
         self._value = val
-        self._pyside_object.setText(str(val))
+        self._changed()
+        if self._pyside_object is not None:
+            self._updateWidget()
         return True
+
+    def fromScript(self, s: str) -> bool:
+        try:
+            return self.setValue(int(_scriptNumber(s)))
+        except ValueError:
+            self._value = s
+            self._changed()
+            return True
+
+    def _createWidget(self) -> QLineEdit:
+        widget = QLineEdit()
+        widget.setValidator(QIntValidator())
+        return widget
+
+    def _updateWidget(self) -> None:
+        self._pyside_object.setText(str(self._value))
     
     def _setPanel(self, panel):
         super()._setPanel(panel)
         def handle_text_changed():
             self._value = int(self._pyside_object.text())
+            self._changed()
             self._panel.knobChanged(self)
-        self._pyside_object.textChanged.connect(handle_text_changed)
+        self._widget().textChanged.connect(handle_text_changed)
 
 class Boolean_Knob(Array_Knob):
     def __init__(self, name, label=None, value=False):
         super().__init__(name, label)
-        self._pyside_object: QCheckBox = QCheckBox(self._label)
         self.setValue(value)
     
     def setValue(self, b: bool) -> bool:
         """Set the boolean value of this knob."""
         self._value = b
-        self._pyside_object.setChecked(b)
+        self._changed()
+        if self._pyside_object is not None:
+            self._updateWidget()
         return True
 
+    def fromScript(self, s: str) -> bool:
+        return self.setValue(s in ("true", "1"))
+
+    def toScript(self, quote: bool = False, context=None) -> str:
+        return "true" if self._value else "false"
+
+    def _createWidget(self) -> QCheckBox:
+        return QCheckBox(self._label)
+
+    def _updateWidget(self) -> None:
+        self._pyside_object.setChecked(self._value)
+
     def _setPanel(self, panel):
         super()._setPanel(panel)
         def handle_toggled():
             self._value = self._pyside_object.isChecked()
+            self._changed()
             self._panel.knobChanged(self)
-        self._pyside_object.toggled.connect(handle_toggled)
+        self._widget().toggled.connect(handle_toggled)
+
+class _SelectedKnob(Boolean_Knob):
+    """The `selected` knob of nodes. Every change of it, setSelected() or not, updates the selection index of the node's group."""
+    def _changed(self) -> None:
+        super()._changed()
+        node = self._node
+        if node is not None and getattr(node, "_parent", None) is not None:
+            node._parent._setNodeSelected(node, bool(self._value))
 
 class String_Knob(Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
         self._value: str = ""
-        self._pyside_object: QLineEdit = QLineEdit()
     
     def setValue(self, val, view='default'):
         self._value = val
-        self._pyside_object.setText(val)
+        self._changed()
+        if self._pyside_object is not None:
+            self._updateWidget()
+
+    def _createWidget(self) -> QLineEdit:
+        return QLineEdit()
+
+    def _updateWidget(self) -> None:
+        self._pyside_object.setText(self._value)
 
     def _setPanel(self, panel):
         super()._setPanel(panel)
         def handle_text_changed():
             self._value = self._pyside_object.text()
+            self._changed()
             self._panel.knobChanged(self)
-        self._pyside_object.textChanged.connect(handle_text_changed)
+        self._widget().textChanged.connect(handle_text_changed)
 
 class EvalString_Knob(String_Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
+        self._references: tuple = ()
+
+    def _changed(self) -> None:
+        # every change of the text, setValue() or a panel edit, keeps the expression dependents index in step
+        self._updateReferences()
+        super()._changed()
+
+    def _updateReferences(self) -> None:
+        """Record the nodes this knob reads through `[value Node.knob]` in the expression dependents index of the groups they are looked up from."""
+        node = self._node
+        references = ()
+        if node is not None and node._parent is not None and isinstance(self._value, str) and "[value" in self._value:
+            references = tuple(node._parent._referenceKey(path) for path in _valueReferenceRe.findall(self._value))
+        if references == self._references:
+            return
+        for group, path in self._references:
+            dependents = group._expressionDependents[path]
+            dependents[node] -= 1
+            if not dependents[node]:
+                del dependents[node]
+                if not dependents:
+                    del group._expressionDependents[path]
+        for group, path in references:
+            dependents = group._expressionDependents.setdefault(path, {})
+            dependents[node] = dependents.get(node, 0) + 1
+        self._references = references
     
     def evaluate(self) -> str:
         """Evaluate the string, performing substitutions."""
-        return tcl(f"return {self.value()}")
+        return self._evaluateWith(_evaluate)
+
+    def _evaluateWith(self, function: Callable[[str], str]) -> str:
+        """`function(value)` with nuke.thisNode() set to the node of the knob, so `[value knob]` reads a knob of the same node."""
+        node = self._node
+        if node is None:
+            return function(self.value())
+        _thisNodes.append(node)
+        try:
+            return function(self.value())
+        finally:
+            _thisNodes.pop()
 
 class Multiline_Eval_String_Knob(EvalString_Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
-        self._pyside_object: QPlainTextEdit = QPlainTextEdit()
-    
-    def setValue(self, val, view='default'):
-        self._value = val
-        self._pyside_object.setPlainText(val)
+
+    def _createWidget(self) -> QPlainTextEdit:
+        return QPlainTextEdit()
+
+    def _updateWidget(self) -> None:
+        self._pyside_object.setPlainText(self._value)
     
     def _setPanel(self, panel):
         Knob._setPanel(self, panel)
         def handle_text_changed():
             self._value = self._pyside_object.toPlainText()
+            self._changed()
             self._panel.knobChanged(self)
-        self._pyside_object.textChanged.connect(handle_text_changed)
+        self._widget().textChanged.connect(handle_text_changed)
 
 class Tab_Knob(Knob):
     def __init__(self, name, label=None):
@@ -405,110 +915,384 @@ class Text_Knob(Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
         self._value: str = ""
-        self._pyside_object: QLabel = QLabel()
     
     def setValue(self, val, chan=None) -> bool:
         """Sets the value `val` at channel `chan`."""
         self._value = val
-        self._pyside_object.setText(val)
+        self._changed()
+        if self._pyside_object is not None:
+            self._updateWidget()
         return True
 
+    def _createWidget(self) -> QLabel:
+        return QLabel()
+
+    def _updateWidget(self) -> None:
+        self._pyside_object.setText(self._value)
+
 class File_Knob(EvalString_Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
     
     def fromUserText(self, s):
         """Assign string to knob, parses frame range off the end and opens file to get set the format."""
-
-        def get_exr_channels(file_path: str) -> list:
-            try:
-                import OpenEXR
-            except ImportError:
-                print("Install OpenEXR library to access loading channels information for EXR files")
-                return []
-
-            ch_map = {"r": "red", "g": "green", "b": "blue", "a": "alpha"}
-            channels = []
-            with OpenEXR.File(file_path) as exr_file:
-                for part in exr_file.parts:
-                    part_channels = []
-                    spl = []
-                    for channel in part.header.get("channels"):
-                        spl = channel.name.split(".")
-                        if len(spl)==1 and spl[0].lower() in ch_map:
-                            spl = ["rgba", spl[0]]
-                        if len(spl)==2:
-                            spl[1] = ch_map.get(spl[1].lower(), spl[1])
-                        part_channels.append(".".join(spl))
-                    if spl and spl[0] == "rgba":
-                        part_channels.reverse()
-                    channels += part_channels
-
-            return channels
-
-        spl = s.split(" ")
-        file_path = spl[0]
-        self.setValue(file_path)
-        first_frame = None
-        if len(spl)>1:
-            spl = spl[1].split("-")
-            first_frame = spl[0]
-            last_frame = spl[1] if len(spl)>1 else first_frame
-            if first_frame.isdigit() and last_frame.isdigit():
-                pass  # TODO выставить первый и последний кадр
-        #  TODO выставить формат
-
-        # get channels
-        if os.path.splitext(file_path)[1].lower() == ".exr" and self.node():
-            matches = list(re.finditer(r"#+|%\d+d", file_path))
-            if matches and isinstance(first_frame, str) and first_frame and first_frame.isdigit():
-                last_match = matches[-1]
-                match_str = last_match.group()
-                padding = len(match_str) if match_str.startswith('#') else int(re.search(r'\d+', match_str).group())
-                start, end = last_match.start(), last_match.end()
-                file_path = file_path[:start] + first_frame.zfill(padding) + file_path[end:]
-            if os.path.isfile(file_path):
-                self.node()._channels = get_exr_channels(file_path)
+        self._applyProbe(_SourceProbe(s))
+
+    def _applyProbe(self, probe: "_SourceProbe", keepRange: bool = False) -> None:
+        """
+        Set the knob and its node from what was probed, on the main thread.
+        With `keepRange` the frame range the node already has is kept: first/last are only set while they are 0-0,
+        origfirst/origlast only while they are 0-0 or when the range was found on disk.
+        """
+        self.setValue(probe.path)
+        node = self.node()
+        if node is None:
+            return
+        if probe.ranges and self is node._data.get("file"):
+            first, last = probe.ranges.minFrame(), probe.ranges.maxFrame()
+            for names, overwrite in ((("first", "last"), False), (("origfirst", "origlast"), probe.detected)):
+                knobs = [node._data.get(name) for name in names]
+                if None in knobs or keepRange and not overwrite and any(knob.value() for knob in knobs):
+                    continue
+                knobs[0].setValue(first)
+                knobs[1].setValue(last)
+        info = probe.info
+        if info is not None:
+            node._channels = list(info.channels)
+            node._metadata = dict(info.metadata)
+            if "format" in node._data:
+                node._data["format"].setValue(_imageFormat(info))
 
     def getEvaluatedValue(self, oc = None) -> str:
         """Returns the string on this knob, will be normalized to technical notation if sequence (%4d). Will also evaluate the string for any tcl expressions"""
-        return self.value()
+        value = self.value()
+        # substituted rather than evaluated as a Tcl word, paths may have spaces
+        return self._evaluateWith(_substitute) if isinstance(value, str) and "[" in value else value
+
+# `#` runs and `%0Nd` in a path are the frame number
+_framePatternRe = re.compile(r"#+|%(\d*)d")
+
+def _frameFormat(path: str) -> str:
+    """str.format() template of a sequence path taking the frame, `#` and `%0Nd` give the padding."""
+    parts = []
+    pos = 0
+    for match in _framePatternRe.finditer(path):
+        parts.append(path[pos:match.start()].replace("{", "{{").replace("}", "}}"))
+        padding = len(match.group()) if match.group()[0] == "#" else int(match.group(1) or 0)
+        parts.append(f"{{0:0{padding}d}}" if padding > 1 else "{0:d}")
+        pos = match.end()
+    parts.append(path[pos:].replace("{", "{{").replace("}", "}}"))
+    return "".join(parts)
+
+def _framePath(path: str, frame: int) -> str:
+    """Path of one frame of a sequence. Paths without a frame pattern are returned as they are."""
+    return _frameFormat(path).format(frame)
+
+class _SourceProbe:
+    """
+    What File_Knob.fromUserText() learns from `path first-last`: the path, the frame ranges and the header of the first frame.
+    Probing only reads the file system, so it can run on any thread; File_Knob._applyProbe() sets the knobs afterwards.
+    """
+    def __init__(self, text: str):
+        # the frame ranges are the words at the end that parse as ranges, the path may contain spaces
+        spl = text.split(" ")
+        ranges = FrameRanges()
+        while len(spl) > 1:
+            try:
+                ranges = FrameRanges(spl[-1]).union(ranges)
+            except ValueError:
+                break
+            spl.pop()
+        self.path = " ".join(spl)
+        # without a range the frames on disk give it
+        self.detected = not ranges
+        self.ranges = ranges or _sequenceRanges(self.path)
+        firstFrame = _framePath(self.path, self.ranges.minFrame()) if self.ranges else self.path
+        self.info = imageinfo.imageInfo(firstFrame)
+
+# frame ranges of sequences on disk by (directory, `#` pattern), with the mtime of the directory they were found at
+_sequenceRangesCache: "collections.OrderedDict[Tuple[str, str], Tuple[int, FrameRanges]]" = collections.OrderedDict()
+_sequenceRangesLock = threading.Lock()
+_sequenceRangesCacheSize = 4096
+
+def _sequenceRanges(path: str) -> FrameRanges:
+    """Frames of a sequence that exist on disk, from the getFileNameList() grouping of its directory. Empty for paths without a frame pattern."""
+    match = None
+    for match in _framePatternRe.finditer(path):
+        pass
+    if match is None:
+        return FrameRanges()
+    padding = len(match.group()) if match.group()[0] == "#" else int(match.group(1) or 1)
+    directory, pattern = os.path.split(f"{path[:match.start()]}{'#' * max(1, padding)}{path[match.end():]}")
+    directory = directory or "."
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return FrameRanges()
+    key = (directory, pattern)
+    with _sequenceRangesLock:
+        cached = _sequenceRangesCache.get(key)
+        if cached is not None and cached[0] == mtime:
+            _sequenceRangesCache.move_to_end(key)
+            return cached[1]
+    ranges = FrameRanges()
+    prefix = pattern + " "
+    for entry in getFileNameList(directory, returnDirs=False, returnHidden=True):
+        if entry.startswith(prefix):
+            ranges = FrameRanges(entry[len(prefix):])
+            break
+    # like getFileNameList(), directories changed within the timestamp granularity are not trusted
+    if time.time_ns() - mtime >= _fileListCacheRacyNs:
+        with _sequenceRangesLock:
+            _sequenceRangesCache[key] = (mtime, ranges)
+            if len(_sequenceRangesCache) > _sequenceRangesCacheSize:
+                _sequenceRangesCache.popitem(last=False)
+    return ranges
+
+def probeReads(nodes: List[Node] = None, workers: int = 8) -> int:
+    """
+    Probe the files of many Reads at once, e.g. after opening a large script: the headers of the first frames are read on a
+    pool of threads, then the channels, format and metadata are set on the nodes on the calling thread. The frame range a
+    Read already has is kept, Reads without one get the frames found on disk.
+    Reads of the same file are probed once.
+    Args:
+        nodes (List[Node]): Optional. Nodes to probe, the ones without a `file` File_Knob are skipped. All Reads of the script by default.
+        workers (int): Optional. Number of files probed at a time.
+    Returns:
+        int: Number of nodes updated.
+    """
+    import concurrent.futures
+
+    if nodes is None:
+        nodes = allNodes("Read", root(), recurseGroups=True)
+    sources: Dict[str, List[File_Knob]] = {}
+    for node in nodes:
+        knob = node._data.get("file")
+        if not isinstance(knob, File_Knob) or not knob.value():
+            continue
+        text = knob.value()
+        first, last = (getattr(node._data.get(name), "_value", None) for name in ("first", "last"))
+        if isinstance(first, (int, float)) and isinstance(last, (int, float)) and (first, last) != (0, 0):
+            text += f" {int(first)}-{int(last)}"
+        sources.setdefault(text, []).append(knob)
+    if not sources:
+        return 0
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(workers, len(sources))), thread_name_prefix="probeReads") as executor:
+        probes = executor.map(_SourceProbe, sources)
+        count = 0
+        for probe, knobs in zip(probes, sources.values()):
+            for knob in knobs:
+                knob._applyProbe(probe, keepRange=True)
+                count += 1
+    return count
+
+def _listNames(directory: str) -> set:
+    """Names of the entries of a directory that are not directories, empty if it can not be listed."""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries if not entry.is_dir()}
+    except OSError:
+        return set()
+
+def sequenceFrames(path: str, frames: Union[FrameRanges, str, Iterable], workers: int = 8) -> Tuple[FrameRanges, FrameRanges]:
+    """
+    Check which frames of a sequence exist. Every directory the frames are in is listed once with os.scandir instead of
+    testing each file, directories of sequences with the frame number in a directory name are listed on a pool of threads.
+    Args:
+        path (str): The sequence, `#` and `%0Nd` give the padding like in File_Knob.fromUserText().
+        frames: The frames to check, a FrameRanges or anything its constructor takes, e.g. `1001-1100`.
+        workers (int): Optional. Number of directories listed at a time.
+    Returns:
+        Tuple[FrameRanges, FrameRanges]: The frames that are present and the frames that are missing.
+    """
+    frames = frames if isinstance(frames, FrameRanges) else FrameRanges(frames)
+    directory, name = os.path.split(path)
+    byDirectory: Dict[str, List[Tuple[int, str]]] = {}
+    if _framePatternRe.search(directory) is None:
+        nameFormat = _frameFormat(name).format
+        byDirectory[directory or "."] = [(frame, nameFormat(frame)) for frame in frames]
+    else:
+        pathFormat = _frameFormat(path).format
+        for frame in frames:
+            directory, name = os.path.split(pathFormat(frame))
+            byDirectory.setdefault(directory or ".", []).append((frame, name))
+    if len(byDirectory) > 1 and workers > 1:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(min(workers, len(byDirectory)), thread_name_prefix="sequenceFrames") as executor:
+            listings = dict(zip(byDirectory, executor.map(_listNames, byDirectory)))
+    else:
+        listings = {directory: _listNames(directory) for directory in byDirectory}
+    present, missing = [], []
+    for directory, names in byDirectory.items():
+        listing = listings[directory]
+        for frame, name in names:
+            (present if name in listing else missing).append(frame)
+    return FrameRanges.fromFrames(present), FrameRanges.fromFrames(missing)
+
+def _sequenceNodes(nodes: Optional[List[Node]], nodeClass: str) -> List[Tuple[Node, str]]:
+    if nodes is None:
+        nodes = allNodes(nodeClass, root(), recurseGroups=True)
+    result = []
+    for node in nodes:
+        knob = node._data.get("file")
+        if isinstance(knob, File_Knob) and knob.value():
+            result.append((node, knob.value()))
+    return result
+
+def missingFrames(nodes: List[Node] = None, workers: int = 8) -> Dict[Node, FrameRanges]:
+    """
+    Find the holes in the sequences of Reads, the frames from `first` to `last` that do not exist.
+    Args:
+        nodes (List[Node]): Optional. Reads to check, all Reads of the script by default.
+        workers (int): Optional. Number of directories listed at a time.
+    Returns:
+        Dict[Node, FrameRanges]: The missing frames of every Read that has any.
+    """
+    result = {}
+    for node, path in _sequenceNodes(nodes, "Read"):
+        first, last = (getattr(node._data.get(name), "_value", None) for name in ("first", "last"))
+        if not isinstance(first, (int, float)) or not isinstance(last, (int, float)):
+            continue
+        missing = sequenceFrames(path, FrameRanges((int(first), int(last))), workers)[1]
+        if missing:
+            result[node] = missing
+    return result
+
+def existingFrames(nodes: List[Node] = None, frames: Union[FrameRanges, str, Iterable] = None, workers: int = 8) -> Dict[Node, FrameRanges]:
+    """
+    Find the frames Writes would overwrite.
+    Args:
+        nodes (List[Node]): Optional. Writes to check, all Writes of the script by default.
+        frames: Optional. Frames to render, the frame range of the root by default.
+        workers (int): Optional. Number of directories listed at a time.
+    Returns:
+        Dict[Node, FrameRanges]: The frames that exist already of every Write that has any.
+    """
+    if frames is None:
+        frames = FrameRanges((int(_root["first_frame"].value()), int(_root["last_frame"].value())))
+    elif not isinstance(frames, FrameRanges):
+        frames = FrameRanges(frames)
+    result = {}
+    for node, path in _sequenceNodes(nodes, "Write"):
+        present = sequenceFrames(path, frames, workers)[0]
+        if present:
+            result[node] = present
+    return result
 
 class Unsigned_Knob(Array_Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
 
+class _EnumerationValues:
+    """
+    Immutable list of enumeration entries, shared by all knobs with the same entries together with its Qt item model.
+    Entries are `name\tmenu path\t\textra` strings, they are split once here so knobs can look values up by index or name.
+    """
+    def __init__(self, items: tuple):
+        self.items = items
+        fields = [item.split("\t") for item in items]
+        self.names: tuple = tuple(f[0] for f in fields)
+        self.menuPaths: tuple = tuple(f[1] if len(f) > 1 else "" for f in fields)
+        self.extras: tuple = tuple("\t".join(f[2:]).strip("\t") for f in fields)
+        self.indices: Dict[str, int] = {}
+        for index, name in enumerate(self.names):
+            self.indices.setdefault(name, index)
+        self._model: QStringListModel = None
+
+    def model(self) -> QStringListModel:
+        if self._model is None:
+            _loadQt()
+            self._model = QStringListModel(list(self.items))
+        return self._model
+
+# entries -> shared values, dropped when no knob uses them any more
+_enumerationValues: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+def _sharedEnumerationValues(items: List[str]) -> _EnumerationValues:
+    key = tuple(items)
+    values = _enumerationValues.get(key)
+    if values is None:
+        values = _enumerationValues[key] = _EnumerationValues(key)
+    return values
+
 class Enumeration_Knob(Unsigned_Knob):
     def __init__(self, name, label = None, values: List[str] = []):
         super().__init__(name, label)
-        self._values: List[str] = []
-        self._pyside_object: QComboBox = QComboBox()
+        self._enumeration: _EnumerationValues = None
+        self._values: tuple = ()
+        self._index: int = None
+        self._value = None
         self.setValues(values)
-        self._value = values[0] if values else None
     
     def setValues(self, items: List[str]):
-        self._values = items
-        self._pyside_object.clear()
-        self._pyside_object.addItems(items)
+        """Replace the list of entries. The current value is kept if it is still in the list, otherwise the first entry is used."""
+        self._enumeration = _sharedEnumerationValues(items)
+        self._values = self._enumeration.items
+        self._index = self._enumeration.indices.get(self._value)
+        if self._index is None and self._values:
+            self._index = 0
+        self._value = self._enumeration.names[self._index] if self._index is not None else None
+        self._changed()
+        if self._pyside_object is not None:
+            self._updateWidget()
+
+    def _createWidget(self) -> QComboBox:
+        return QComboBox()
+
+    def _updateWidget(self) -> None:
+        self._pyside_object.setModel(self._enumeration.model())
+        if self._index is not None:
+            self._pyside_object.setCurrentIndex(self._index)
 
     def setValue(self, item):
         """Set the current value. If item is of an Integer type it will treat it as an index to the enum, otherwise as a value."""
-        if isinstance(item, int) and item < len(self._values):
-            self._value = self._values[item]
-            return True
+        if isinstance(item, int):
+            if not 0 <= item < len(self._values):
+                return False
+            index = item
         else:
-            for v in self._values:
-                if v.split("\t")[0] == item:
-                    self._value = item
-                    return True
-        return False
+            index = self._enumeration.indices.get(item)
+            if index is None:
+                return False
+        self._index = index
+        self._value = self._enumeration.names[index]
+        self._changed()
+        if self._pyside_object is not None:
+            self._pyside_object.setCurrentIndex(index)
+        return True
+
+    def fromScript(self, s: str) -> bool:
+        """Set the value from its text in a .nk script. A name that is not in the list is kept as it is, so reading and saving a script does not lose it."""
+        if self.setValue(s):
+            return True
+        if s.isdigit() and self.setValue(int(s)):
+            return True
+        self._index = None
+        self._value = s
+        self._changed()
+        return True
+
+    def toScript(self, quote: bool = False, context=None) -> str:
+        return Knob.toScript(self, quote, context)
 
     def values(self):
-        return self._values
+        return list(self._values)
+
+    def getValue(self) -> float:
+        """Index of the current value as a float, 0 if the value is not one of the entries. value() returns its name."""
+        return float(self._index or 0)
+
+    def enumName(self, n: int) -> str:
+        """Return name of the item at index n."""
+        return self._enumeration.names[n]
+
+    def numValues(self) -> int:
+        """Return number of values."""
+        return len(self._values)
 
     def _setPanel(self, panel):
         super()._setPanel(panel)
-        self._pyside_object.currentIndexChanged.connect(lambda: self._panel.knobChanged(self))
+        self._widget().currentIndexChanged.connect(lambda: self._panel.knobChanged(self))
 
 class Channel_Knob(Knob):
     def __init__(self, name, label=None):
@@ -523,21 +1307,32 @@ class ChannelMask_Knob(Channel_Knob):
 class Script_Knob(String_Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
-        self._pyside_object: QPushButton = QPushButton(self._label)
+
+    def _createWidget(self) -> QPushButton:
+        return QPushButton(self._label)
+
+    def _updateWidget(self) -> None:
+        pass
     
     def _setPanel(self, panel):
         Knob._setPanel(self, panel)
-        self._pyside_object.clicked.connect(lambda: self._panel.knobChanged(self))
+        self._widget().clicked.connect(lambda: self._panel.knobChanged(self))
 
 class PyScript_Knob(Script_Knob):
     def __init__(self, name, label=None):
         super().__init__(name, label)
 
 class Node:
+    # number of inputs taken from the node stack when a script does not give `inputs`
+    _scriptInputs = 1
+    # (inputs, mask inputs) of a masked node read from `inputs 2+1`, written back in the same form
+    _scriptMaskInputs: Tuple[int, int] = None
+
     def __init__(self):
         self._data = {}
+        self._parent: Group = None
         self.addKnob(String_Knob("name", ""))
-        self.addKnob(Boolean_Knob("selected", ""))
+        self.addKnob(_SelectedKnob("selected", ""))
         self.addKnob(Array_Knob("xpos", "INVISIBLE"))
         self.addKnob(Array_Knob("ypos", "INVISIBLE"))
         self.addKnob(Boolean_Knob("postage_stamp", "Postage Stamp"))
@@ -567,9 +1362,28 @@ class Node:
         return self.__class__.__name__
 
     def addKnob(self, k: Knob) -> None:
-        """Add knob k to this node or panel."""
-        self._data[k.name()] = k
+        """Add knob k to this node or panel. Knobs added once the node is in a group are user knobs, scripts get their definition."""
         k._node = self
+        k._default = k._value
+        if self._parent is None:
+            self._data[k.name()] = k
+            return
+        with _graphLock:
+            self._data[k.name()] = k
+        k.setFlag(WRITE_USER_KNOB_DEFS)
+        _scriptChanged(self, structural=True)
+
+    def readKnobs(self, s: str) -> None:
+        """Read the knobs from a string (TCL syntax)."""
+        nkscript.readKnobs(self, s)
+
+    def writeKnobs(self, i: int = TO_SCRIPT | WRITE_NON_DEFAULT_ONLY | WRITE_USER_KNOB_DEFS) -> str:
+        """
+        Return the knobs in script syntax, one `name value` per line.
+        Args:
+            i (int): WRITE_ALL writes every knob, WRITE_NON_DEFAULT_ONLY only the knobs that are not at their default, WRITE_USER_KNOB_DEFS adds the addUserKnob definitions of user knobs.
+        """
+        return "\n".join(f"{name} {value}" for name, value in nkscript.knobItems(self, i))
 
     def allKnobs(self) -> List[Knob]:
         """Get a list of all knobs in this node, including nameless knobs."""
@@ -587,21 +1401,40 @@ class Node:
         return self._data.get(name)
 
     def setName(self, name, uncollide=True, updateExpressions=False):
-        name = name.rstrip("0123456789")
-        node_names = [node.name() for node in allNodes()]
-        index = 1
-        while f"{name}{index}" in node_names:
-            index += 1
-        self._data["name"].setValue(f"{name}{index}")
+        """
+        Set name of the node and resolve name collisions if optional named argument 'uncollide' is True.
+        Args:
+            name (str): New name. With `uncollide` the trailing digits are replaced by the lowest free index, e.g. `Blur` becomes `Blur1`.
+            uncollide (bool): Optional. If False the name is used as is and ValueError is raised if another node already has it.
+            updateExpressions (bool): Optional. Not supported.
+        """
+        group = self._parent if self._parent is not None else thisGroup()
+        group._renameNode(self, name, uncollide)
     
     def name(self):
         return self._data["name"].value()
 
+    def fullName(self) -> str:
+        """Get the name of this node and any groups enclosing it in 'group.group.name' form."""
+        names = [self.name()]
+        group = self._parent
+        while group is not None and group is not _root:
+            names.append(group.name())
+            group = group._parent
+        return ".".join(reversed(names))
+
     def channels(self) -> List[str]:
         """List channels output by this node."""
         # TODO Сделать чтобы нода спрашивала у нод сверху какие каналы есть
         return self._channels
 
+    def format(self) -> Format:
+        """Format of the node, the value of its format knob or the root format if it has none."""
+        knob = self._data.get("format")
+        if isinstance(knob, Format_Knob) and knob.value() is not None:
+            return knob.value()
+        return _root["format"].value()
+
     def lastFrame(self) -> int:
         """Last frame in frame range for this node."""
         return 0
@@ -622,8 +1455,16 @@ class Node:
         return self._metadata.get(key)
 
     def setInput(self, i: int, node: Type["Node"]) -> bool:
-        """Connect input i to node if canSetInput() returns true."""
-        self._inputs[i] = node
+        """Connect input i to node if canSetInput() returns true. Passing None disconnects the input."""
+        with _graphLock:
+            previous = self._inputs.get(i)
+            if node is None:
+                self._inputs.pop(i, None)
+            else:
+                self._inputs[i] = node
+            if self._parent is not None:
+                self._parent._inputChanged(self, previous, node)
+                _scriptChanged(self, structural=True)
         return True
 
     def input(self, i: int) -> Union[Type["Node"], None]:
@@ -632,7 +1473,7 @@ class Node:
 
     def inputs(self) -> int:
         """Gets the maximum number of connected inputs. Number of the highest connected input + 1. If inputs 0, 1, and 3 are connected, this will return 4."""
-        return len(self._inputs)
+        return max(self._inputs) + 1 if self._inputs else 0
 
     def isSelected(self) -> bool:
         """Returns the current selection state of the node. This is the same as checking the 'selected' knob."""
@@ -673,7 +1514,11 @@ class Node:
         """Height of the node when displayed on screen in the DAG, at 1:1 zoom, in pixels."""
         return self._screenHeight
 
-    def dependencies(self, what: int) -> List[Type["Node"]]:
+    def _inputsHidden(self) -> bool:
+        hide_input = self._data.get("hide_input")
+        return bool(hide_input is not None and hide_input.value())
+
+    def dependencies(self, what: int = INPUTS | HIDDEN_INPUTS | EXPRESSIONS) -> List[Type["Node"]]:
         """
         List all nodes referred to by this node. 'what' is an optional integer (see below).
         You can use the following constants or'ed together to select what types of dependencies are looked for:
@@ -688,9 +1533,19 @@ class Node:
         Example:
             >>> nuke.toNode('Blur1').dependencies( nuke.INPUTS | nuke.EXPRESSIONS )
         """
-        return []
+        result = {}
+        if what & (HIDDEN_INPUTS if self._inputsHidden() else INPUTS):
+            result.update(dict.fromkeys(self._inputs.values()))
+        if what & EXPRESSIONS:
+            for knob in self._data.values():
+                for group, path in getattr(knob, "_references", ()):
+                    node = group.node(path)
+                    if node is not None:
+                        result[node] = None
+        result.pop(self, None)
+        return list(result)
     
-    def dependent(self, what: int, forceEvaluate: bool = True) -> List[Type["Node"]]:
+    def dependent(self, what: int = INPUTS | HIDDEN_INPUTS | EXPRESSIONS, forceEvaluate: bool = True) -> List[Type["Node"]]:
         """
         List all nodes that read information from this node. 'what' is an optional integer:
                 You can use any combination of the following constants or'ed together to select what types of dependent nodes to look for:
@@ -708,27 +1563,255 @@ class Node:
         Example:
             >>> nuke.toNode('Blur1').dependent( nuke.INPUTS | nuke.EXPRESSIONS )
         """
-        return []
+        result = {}
+        if what & (INPUTS | HIDDEN_INPUTS) and self._parent is not None:
+            for node in self._parent._dependents.get(self, ()):
+                if what & (HIDDEN_INPUTS if node._inputsHidden() else INPUTS):
+                    result[node] = None
+        if what & EXPRESSIONS and self._parent is not None:
+            # the node is `name` from its group, `group.name` from the group above and so on
+            path = self.name()
+            group = self._parent
+            while group is not None:
+                result.update(dict.fromkeys(group._expressionDependents.get(path, ())))
+                path = f"{group.name()}.{path}"
+                group = group._parent
+        result.pop(self, None)
+        return list(result)
 
 class Group(Node):
     def __init__(self):
         super().__init__()
-        self._nodes: List[Node] = []
+        # insertion ordered set of the group's nodes
+        self._nodes: Dict[Node, None] = {}
+        self._nodesByName: Dict[str, Node] = {}
+        # class name -> insertion ordered set of nodes, and the child groups to walk with recurseGroups
+        self._nodesByClass: Dict[str, Dict[Node, None]] = {}
+        self._groups: Dict[Group, None] = {}
+        # selected nodes, plus caches of the inputs-first node order and of the ordered selection
+        self._selected: Dict[Node, None] = {}
+        # reverse edges: upstream node -> downstream node -> number of inputs connected to it
+        self._dependents: Dict[Node, Dict[Node, int]] = {}
+        self._topologicalIndex: Dict[Node, int] = None
+        self._selectionOrder: List[Node] = None
+        # path relative to this group -> nodes whose knobs read the node at it through [value path.knob], with a count of such references.
+        # Keyed by group and relative path, the entries stay valid when enclosing groups are renamed.
+        self._expressionDependents: Dict[str, Dict[Node, int]] = {}
+        # prefix -> lowest index that may still be free / min-heap of indices freed below it
+        self._nameCounters: Dict[str, int] = {}
+        self._freeNameIndices: Dict[str, List[int]] = {}
     
     def nodes(self) -> List[Node]:
         """List of nodes in group."""
-        return self._nodes
+        return list(self._nodes)
+
+    def begin(self) -> "Group":
+        """All python code that follows will be executed in the context of this group, e.g. createNode() adds nodes to it. Must be paired with end()."""
+        _groupStack.append(self)
+        return self
+
+    def end(self) -> None:
+        """All python code that follows will no longer be executed in the context of this group."""
+        if _groupStack and _groupStack[-1] is self:
+            _groupStack.pop()
+
+    def __enter__(self) -> "Group":
+        return self.begin()
+
+    def __exit__(self, *args) -> None:
+        self.end()
+
+    def node(self, s: str) -> Union[Node, None]:
+        """
+        Locate a node by name.
+        Args:
+            s (str): The name of the node. Dotted names like `Group1.Blur1` are looked up inside child groups, a leading `root.` starts the search from the root.
+        Returns:
+            Node: The node or None if there is no node with this name.
+        """
+        if "." not in s:
+            return self._nodesByName.get(s)
+        names = s.split(".")
+        group = self
+        if names[0] == "root":
+            group = root()
+            names = names[1:]
+        for name in names[:-1]:
+            group = group._nodesByName.get(name)
+            if not isinstance(group, Group):
+                return None
+        return group._nodesByName.get(names[-1])
+
+    def _addNode(self, node: Node) -> None:
+        self._adoptNode(node)
+        self._indexNodes([node])
+
+    def _adoptNode(self, node: Node) -> None:
+        """Make the group the parent of node and reserve its name. Inside nuke.batch() this is all createNode does until the batch ends."""
+        node._parent = self
+        if node.name() in self._nodesByName:
+            node._data["name"].setValue(self._uniqueName(node.name().rstrip("0123456789")))
+        self._nodesByName[node.name()] = node
+        for upstream in node._inputs.values():
+            self._addEdge(upstream, node)
+
+    def _indexNodes(self, nodes: List[Node]) -> None:
+        """Add adopted nodes to the node list and the class, group and selection indexes."""
+        for node in nodes:
+            self._nodes[node] = None
+            self._nodesByClass.setdefault(node.Class(), {})[node] = None
+            if isinstance(node, Group):
+                self._groups[node] = None
+            if node.isSelected():
+                self._selected[node] = None
+            for knob in node._data.values():
+                if isinstance(knob, EvalString_Knob):
+                    knob._updateReferences()
+        self._topologyChanged()
+
+    def _removeNode(self, node: Node) -> None:
+        if node in _batchNodes:
+            del _batchNodes[node]
+        else:
+            del self._nodes[node]
+        self._releaseName(node)
+        nodes = self._nodesByClass.get(node.Class())
+        if nodes is not None:
+            nodes.pop(node, None)
+            if not nodes:
+                del self._nodesByClass[node.Class()]
+        self._groups.pop(node, None)
+        self._selected.pop(node, None)
+        for upstream in node._inputs.values():
+            self._removeEdge(upstream, node)
+        for downstream in self._dependents.pop(node, ()):
+            for i in [i for i, upstream in downstream._inputs.items() if upstream is node]:
+                del downstream._inputs[i]
+        node._parent = None
+        for knob in node._data.values():
+            if isinstance(knob, EvalString_Knob):
+                knob._updateReferences()
+        self._topologyChanged()
+
+    def _renameNode(self, node: Node, name: str, uncollide: bool = True) -> None:
+        with _graphLock:
+            self._renameNodeLocked(node, name, uncollide)
+        if node._parent is self:
+            _scriptChanged(node, structural=True)
+
+    def _renameNodeLocked(self, node: Node, name: str, uncollide: bool) -> None:
+        registered = node._parent is self
+        if registered:
+            self._releaseName(node)
+        if uncollide:
+            name = self._uniqueName(name.rstrip("0123456789"))
+        elif name in self._nodesByName:
+            if registered:
+                self._nodesByName[node.name()] = node
+            raise ValueError(f"{name} is already in use")
+        node._data["name"].setValue(name)
+        if registered:
+            self._nodesByName[name] = node
+
+    def _uniqueName(self, prefix: str) -> str:
+        """Lowest free `prefix<N>` name. Amortised O(1): stale heap entries are dropped once and the counter only moves forward."""
+        free = self._freeNameIndices.get(prefix)
+        while free:
+            name = f"{prefix}{free[0]}"
+            if name not in self._nodesByName:
+                return name
+            heapq.heappop(free)
+        index = self._nameCounters.get(prefix, 1)
+        while f"{prefix}{index}" in self._nodesByName:
+            index += 1
+        self._nameCounters[prefix] = index
+        return f"{prefix}{index}"
+
+    def _releaseName(self, node: Node) -> None:
+        name = node.name()
+        if self._nodesByName.get(name) is not node:
+            return
+        del self._nodesByName[name]
+        prefix = name.rstrip("0123456789")
+        digits = name[len(prefix):]
+        if digits and digits[0] != "0" and int(digits) < self._nameCounters.get(prefix, 1):
+            heapq.heappush(self._freeNameIndices.setdefault(prefix, []), int(digits))
 
     def selectedNodes(self) -> list:
-        """Selected nodes."""
-        res = []
-        for n in self._nodes:
-            selected = n.isSelected()
-            if selected:
-                res.append(n)
-        return res
+        """Selected nodes, inputs before the nodes that use them."""
+        if self._selectionOrder is None:
+            if self._topologicalIndex is None:
+                self._topologicalIndex = {node: index for index, node in enumerate(self._topologicalOrder())}
+            self._selectionOrder = sorted(self._selected, key=self._topologicalIndex.__getitem__)
+        return list(self._selectionOrder)
+
+    def _topologicalOrder(self) -> List[Node]:
+        """All nodes of the group ordered so that inputs come before the nodes using them."""
+        order = []
+        visited = set()
+        for start in self._nodes:
+            if start in visited:
+                continue
+            visited.add(start)
+            stack = [(start, iter(start._inputs.values()))]
+            while stack:
+                node, inputs = stack[-1]
+                for upstream in inputs:
+                    if upstream is not None and upstream not in visited and upstream._parent is self:
+                        visited.add(upstream)
+                        stack.append((upstream, iter(upstream._inputs.values())))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        return order
+
+    def _inputChanged(self, node: Node, previous: Union[Node, None], upstream: Union[Node, None]) -> None:
+        if previous is not None:
+            self._removeEdge(previous, node)
+        if upstream is not None:
+            self._addEdge(upstream, node)
+        self._topologyChanged()
+
+    def _addEdge(self, upstream: Node, node: Node) -> None:
+        dependents = self._dependents.setdefault(upstream, {})
+        dependents[node] = dependents.get(node, 0) + 1
+
+    def _removeEdge(self, upstream: Node, node: Node) -> None:
+        dependents = self._dependents.get(upstream)
+        if dependents is None or node not in dependents:
+            return
+        dependents[node] -= 1
+        if not dependents[node]:
+            del dependents[node]
+            if not dependents:
+                del self._dependents[upstream]
+
+    def _referenceKey(self, path: str) -> Tuple["Group", str]:
+        """The group `path` is looked up from when written inside this group, and the path relative to it."""
+        if path.startswith("root."):
+            return _root, path[5:]
+        if path == "root":
+            return _root, path
+        return self, path
+
+    def _topologyChanged(self) -> None:
+        self._topologicalIndex = None
+        self._selectionOrder = None
+
+    def _setNodeSelected(self, node: Node, selected: bool) -> None:
+        # nodes of a running batch() are added to the index with their selected knob by _indexNodes
+        if node in _batchNodes or selected == (node in self._selected):
+            return
+        if selected:
+            self._selected[node] = None
+        else:
+            del self._selected[node]
+        self._selectionOrder = None
 
 class Root(Group):
+    _scriptInputs = 0
+
     def __init__(self):
         super().__init__()
         self._data["name"].setValue("")
@@ -768,6 +1851,15 @@ class Root(Group):
     def setName(self, name):
         self._data["name"].setValue(name.replace("\\", "/"))
 
+    def modified(self) -> bool:
+        """Return the 'modified' flag, True if the script was changed since it was last opened or saved."""
+        return _scriptVersion != _savedScriptVersion
+
+    def setModified(self, b: bool) -> None:
+        """Set the 'modified' flag."""
+        global _savedScriptVersion
+        _savedScriptVersion = -1 if b else _scriptVersion
+
 class Preferences(Node):
     def __init__(self):
         super().__init__()
@@ -790,6 +1882,8 @@ class Dot(Node):
         super().__init__()
 
 class Read(Node):
+    _scriptInputs = 0
+
     def __init__(self):
         super().__init__()
         self.addKnob(File_Knob("file", "File"))
@@ -797,6 +1891,7 @@ class Read(Node):
         self.addKnob(Int_Knob("last", ""))
         self.addKnob(Int_Knob("origfirst", "Original Range"))
         self.addKnob(Int_Knob("origlast", ""))
+        self.addKnob(Format_Knob("format", "Format"))
         kn = Enumeration_Knob("frame_mode", "Frame")
         kn.setValues(['expression', 'start at', 'offset'])
         self.addKnob(kn)
@@ -814,7 +1909,7 @@ class Write(Node):
         kn.setValues([" ", "cin", "dpx", "exr", "hdr", "jpeg", "mov\t\t\tffmpeg", "mxf", "null", "pic", "png", "sgi", "targa", "tiff", "xpm", "yuv"])
         self.addKnob(kn)
         kn = Enumeration_Knob("colorspace", "Output Transform")
-        kn.setValues(colorspaces_list)
+        kn.setValues(_colorspaces())
         self.addKnob(kn)
         # mov64
         kn = Enumeration_Knob("mov64_codec", "Codec")
@@ -841,6 +1936,8 @@ class Write(Node):
         self.addKnob(kn)
 
 class Copy(Node):
+    _scriptInputs = 2
+
     def __init__(self):
         super().__init__()
         for i in range(4):
@@ -869,6 +1966,8 @@ class Remove(Node):
         self.addKnob(ChannelMask_Knob("channels", ""))
 
 class Merge2(Node):
+    _scriptInputs = 2
+
     def __init__(self):
         super().__init__()
         self.addKnob(Enumeration_Knob("operation", ""))
@@ -879,6 +1978,8 @@ class Merge2(Node):
         self.addKnob(Enumeration_Knob("bbox", "set bbox to "))
 
 class MergeExpression(Node):
+    _scriptInputs = 2
+
     def __init__(self):
         super().__init__()
         for i in range(4):
@@ -928,35 +2029,147 @@ class Viewer(Node):
                 v._active_input = i
         return res
 
+_valueReferenceRe = re.compile(r"\[value\s+([\w.]+)\.\w+\s*\]")
+
+def dependencies(nodes: List[Node], what: int = INPUTS | HIDDEN_INPUTS | EXPRESSIONS) -> List[Node]:
+    """
+    List all nodes referred to by the nodes argument.
+    Args:
+        nodes (List[Node]): Nodes to check.
+        what (int): Or'ed constant of `nuke.EXPRESSIONS`, `nuke.INPUTS` and `nuke.HIDDEN_INPUTS`.
+    """
+    result = {}
+    for node in nodes:
+        result.update(dict.fromkeys(node.dependencies(what)))
+    return list(result)
+
+def dependentNodes(what: int = INPUTS | HIDDEN_INPUTS | EXPRESSIONS, nodes: List[Node] = [], evaluateAll: bool = True) -> List[Node]:
+    """
+    List all nodes that read information from the nodes argument.
+    Args:
+        what (int): Or'ed constant of `nuke.EXPRESSIONS`, `nuke.INPUTS` and `nuke.HIDDEN_INPUTS`.
+        nodes (List[Node]): Nodes to check.
+        evaluateAll (bool): Not used, the dependents index is always up to date.
+    """
+    result = {}
+    for node in nodes:
+        result.update(dict.fromkeys(node.dependent(what)))
+    return list(result)
+
+def upstreamNodes(nodes: List[Node], what: int = INPUTS | HIDDEN_INPUTS | EXPRESSIONS) -> List[Node]:
+    """All nodes the given nodes depend on, directly or through other nodes. Each node is visited once."""
+    return _walkGraph(nodes, lambda node: node.dependencies(what))
+
+def downstreamNodes(nodes: List[Node], what: int = INPUTS | HIDDEN_INPUTS | EXPRESSIONS) -> List[Node]:
+    """All nodes that depend on the given nodes, directly or through other nodes. Each node is visited once."""
+    return _walkGraph(nodes, lambda node: node.dependent(what))
+
+def _walkGraph(nodes: List[Node], neighbours: Callable[[Node], List[Node]]) -> List[Node]:
+    visited = dict.fromkeys(nodes)
+    result = {}
+    stack = list(nodes)
+    while stack:
+        for node in neighbours(stack.pop()):
+            if node not in visited:
+                visited[node] = None
+                result[node] = None
+                stack.append(node)
+    return list(result)
+
+# class name -> Node subclass built by createNode
+_nodeClasses: Dict[str, Type[Node]] = {cls.__name__: cls for cls in (
+    Read, Copy, Unpremult, Shuffle2, Remove, Merge2, Group, MergeExpression, Dot, Reformat, TimeClip, FrameRange, AppendClip, Write, Viewer
+)}
+
+def registerNodeClass(cls: Type[Node], nodeClass: str = None) -> None:
+    """
+    Make createNode() build `cls` for the class name `nodeClass`, so plugins can add their own nodes or replace built-in ones.
+    Args:
+        cls (Type[Node]): Node subclass.
+        nodeClass (str): Optional. Class name, defaults to the name of `cls`.
+    """
+    _nodeClasses[nodeClass or cls.__name__] = cls
+
+# nodes created inside nuke.batch() that are not indexed yet (with whether onUserCreate should run), and the batch nesting depth
+_batchNodes: Dict[Node, bool] = {}
+_batchDepth = 0
+
+@contextlib.contextmanager
+def batch():
+    """
+    Context manager for building many nodes at once:
+        with nuke.batch():
+            for i in range(10000):
+                nuke.createNode("Dot")
+    Inside the batch createNode only builds the node and reserves its name, so toNode() already finds it. The nodes are added to
+    the class, group and selection indexes in one pass when the outermost batch ends, allNodes() does not list them before that.
+    Then the onCreate and onUserCreate callbacks run once per node class for all new nodes.
+    """
+    global _batchDepth
+    _batchDepth += 1
+    try:
+        yield
+    finally:
+        _batchDepth -= 1
+        if not _batchDepth:
+            _flushBatch()
+
+def _flushBatch() -> None:
+    nodes = list(_batchNodes)
+    userCreated = [node for node, user in _batchNodes.items() if user]
+    _batchNodes.clear()
+    byGroup: Dict[Group, List[Node]] = {}
+    for node in nodes:
+        byGroup.setdefault(node._parent, []).append(node)
+    with _graphLock:
+        for group, groupNodes in byGroup.items():
+            group._indexNodes(groupNodes)
+    _runNodeCallbacks(onCreates, nodes)
+    _runNodeCallbacks(onUserCreates, userCreated)
+
+def _runNodeCallbacks(callbacks: Dict[str, list], nodes: List[Node]) -> None:
+    """Run the callbacks registered in `callbacks` (e.g. onCreates) for every node with nuke.thisNode() set to it. Callback lists are looked up once per node class."""
+    byClass: Dict[str, List[Node]] = {}
+    for node in nodes:
+        byClass.setdefault(node.Class(), []).append(node)
+    for nodeClass, classNodes in byClass.items():
+        calls = callbacks.get(nodeClass, []) + callbacks.get("*", [])
+        if not calls:
+            continue
+        for node in classNodes:
+            _thisNodes.append(node)
+            try:
+                for call, args, kwargs, target in calls:
+                    if target is None or target is node:
+                        call(*args, **kwargs)
+            finally:
+                _thisNodes.pop()
+
 def createNode(nodeClass: str, inpanel: bool = True) -> Node:
-    node_types = {
-        "Read": Read,
-        "Copy": Copy,
-        "Unpremult": Unpremult,
-        "Shuffle2": Shuffle2,
-        "Remove": Remove,
-        "Merge2": Merge2,
-        "Group": Group,
-        "MergeExpression": MergeExpression,
-        "Dot": Dot,
-        "Reformat": Reformat,
-        "TimeClip": TimeClip,
-        "FrameRange": FrameRange,
-        "AppendClip": AppendClip,
-        "Write": Write,
-        "Viewer": Viewer
-    }
-
-    if nodeClass in node_types:
-        node = node_types[nodeClass]()
-        root()._nodes.append(node)
-        if nodeClass == "Viewer":
-            for v in _viewerWindows:
-                v._active = False
-            _viewerWindows.append(ViewerWindow(node))
-        return node
-    
-    return Node()
+    cls = _nodeClasses.get(nodeClass)
+    if cls is None:
+        return Node()
+    return _newNode(cls, thisGroup())
+
+def _newNode(cls: Type[Node], group: Group, userCreate: bool = True) -> Node:
+    """Build a node of class `cls` in `group`. Nodes read from scripts are not user created, onUserCreate does not run for them."""
+    node = cls()
+    with _graphLock:
+        if _batchDepth:
+            group._adoptNode(node)
+            _batchNodes[node] = userCreate
+        else:
+            group._addNode(node)
+    _scriptChanged(node, structural=True)
+    if isinstance(node, Viewer):
+        for v in _viewerWindows:
+            v._active = False
+        _viewerWindows.append(ViewerWindow(node))
+    if not _batchDepth:
+        _runNodeCallbacks(onCreates, [node])
+        if userCreate:
+            _runNodeCallbacks(onUserCreates, [node])
+    return node
 
 def root() -> Root:
     """
@@ -977,16 +2190,37 @@ def allNodes(filter: str = None, group = None, recurseGroups : bool = False) ->
         group (): Optional. If the group is omitted the current group (ie the group the user picked a menu item from the toolbar of) is used.
         recurseGroups (bool): Optional. If True, will also return all child nodes within any group nodes. This is done recursively and defaults to False.
     """
+    if group is None:
+        group = thisGroup()
+    if recurseGroups:
+        return list(iterNodes(filter, group, recurseGroups))
     if filter:
-        return [n for n in root().nodes() if n.Class() == filter]
-    return root().nodes()
+        return list(group._nodesByClass.get(filter, ()))
+    return group.nodes()
+
+def iterNodes(filter: str = None, group = None, recurseGroups : bool = False) -> Iterator[Node]:
+    """
+    Lazy version of allNodes() for streaming through large scripts without building lists.
+    Nested groups are walked with an explicit stack, each group's own nodes come before the nodes of its child groups.
+    The script must not be modified while the iterator is in use.
+    Args:
+        filter (str): Optional. Only yield nodes of the specified class.
+        group (Group): Optional. Group to start from, the current group by default.
+        recurseGroups (bool): Optional. If True, also yields the nodes of child groups recursively.
+    """
+    stack = [group if group is not None else thisGroup()]
+    while stack:
+        group = stack.pop()
+        yield from (group._nodesByClass.get(filter, ()) if filter else group._nodes)
+        if recurseGroups:
+            stack.extend(reversed(group._groups))
 
 def selectedNode() -> Node:
     """Returns the 'node the user is thinking about'. If several nodes are selected, this returns one of them. The one returned will be an 'output' node in that no other selected nodes use that node as an input.
     If no nodes are selected, then if the last thing typed was a hotkey this returns the node the cursor is pointing at. If none, or the last event was not a hotkey, this produces a 'No node selected' error."""
-    nodes = root().selectedNodes()
+    nodes = thisGroup().selectedNodes()
     if nodes:
-        return nodes[0]
+        return nodes[-1]
     raise ValueError("no node selected")
 
 def selectedNodes(filter: str = None) -> List[Node]:
@@ -995,60 +2229,226 @@ def selectedNodes(filter: str = None) -> List[Node]:
     Args:
         filter (str): Optional class of Node. Instructs the algorithm to apply only to a specific class of nodes.
     """
-    nodes = root().selectedNodes()
+    nodes = thisGroup().selectedNodes()
     if filter:
         return [n for n in nodes if n.Class() == filter]
     return nodes
 
 def toNode(s: str) -> Node:
     """Search for a node in the DAG by name and return it as a Python object."""
-    for node in allNodes():
-        if node.name() == s:
-            return node
+    node = thisGroup().node(s)
+    if node is not None:
+        return node
     if s == "root":
         return root()
     if s == "preferences":
         return _preferences
     return None
 
+# Grouped listings of getFileNameList() by directory and flags, reused while the directory's mtime is unchanged.
+# Least recently used listings are dropped once they take more than $NUKE_FILE_LIST_CACHE_SIZE (MB, default 64, 0 turns the cache off).
+_fileListCache: "collections.OrderedDict[tuple, Tuple[tuple, int, Tuple[str, ...]]]" = collections.OrderedDict()
+_fileListCacheLock = threading.Lock()
+_fileListCacheSize = 0
+_fileListCacheStats = {"hits": 0, "misses": 0, "racy": 0, "evictions": 0}
+_fileListCacheRacyNs = 2_000_000_000
+try:
+    _fileListCacheLimit = int(float(os.environ.get("NUKE_FILE_LIST_CACHE_SIZE", 64)) * 1024 * 1024)
+except ValueError:
+    _fileListCacheLimit = 0
+_fileListCacheEnabled = _fileListCacheLimit > 0
+
+def fileNameListCacheStats() -> dict:
+    """
+    Statistics of the cache of getFileNameList() results.
+    Returns:
+        dict: `hits`, `misses`, `evictions` and `racy` (listings of directories changed too recently to keep) in this session, `entries`, `size` and `limit` (bytes) of the cache and whether it is `enabled`.
+    """
+    with _fileListCacheLock:
+        return dict(_fileListCacheStats, entries=len(_fileListCache), size=_fileListCacheSize, limit=_fileListCacheLimit, enabled=_fileListCacheEnabled)
+
+def clearFileNameListCache() -> None:
+    """Forget all cached getFileNameList() results."""
+    global _fileListCacheSize
+    with _fileListCacheLock:
+        _fileListCache.clear()
+        _fileListCacheSize = 0
+
+def setFileNameListCacheEnabled(enabled: bool) -> None:
+    """Turn the cache of getFileNameList() results on or off. Turning it off clears it."""
+    global _fileListCacheEnabled
+    _fileListCacheEnabled = bool(enabled) and _fileListCacheLimit > 0
+    if not _fileListCacheEnabled:
+        clearFileNameListCache()
+
+# file names of sequence frames: prefix, frame number, extension
+_frameFileRe = re.compile(r"^(.*?)(\d+)(\.[^.]+)$")
+
+def _groupFrameFiles(names: List[str]) -> Tuple[Dict[Tuple[str, int, str], List[int]], List[str]]:
+    """
+    Group file names into sequences by prefix, padding width and extension, returning them and the names that are not frames.
+    Zero padded numbers give the width, numbers without padding join the widest sequence they fit, e.g. 10000 joins `####`.
+    """
+    padded: Dict[Tuple[str, int, str], List[int]] = {}
+    unpadded: Dict[Tuple[str, str], List[str]] = {}
+    singles = []
+    match = _frameFileRe.match
+    for name in names:
+        m = match(name)
+        if m is None:
+            singles.append(name)
+            continue
+        prefix, digits, ext = m.groups()
+        if digits[0] == "0" and len(digits) > 1:
+            padded.setdefault((prefix, len(digits), ext), []).append(int(digits))
+        else:
+            unpadded.setdefault((prefix, ext), []).append(digits)
+    if unpadded:
+        widths: Dict[Tuple[str, str], List[int]] = {}
+        for prefix, width, ext in padded:
+            widths.setdefault((prefix, ext), []).append(width)
+        for (prefix, ext), numbers in unpadded.items():
+            candidates = sorted(widths.get((prefix, ext), ()))
+            shortest = min(len(digits) for digits in numbers)
+            for digits in numbers:
+                width = max((w for w in candidates if w <= len(digits)), default=shortest)
+                padded.setdefault((prefix, width, ext), []).append(int(digits))
+    return padded, singles
+
 def getFileNameList(dir: str, splitSequences: bool = False, extraInformation: bool = False, returnDirs: bool = True, returnHidden: bool = False) -> List[str]:
     """
+    List a directory with frames grouped into sequences, e.g. `render.####.exr 1-10 12-20`. The padding is kept as `#` per digit, gaps split the range.
     Args:
         dir (str): The directory to get sequences from.
-        splitSequences (bool): Whether to split sequences or not.
-        extraInformation (bool): Whether or not there should be extra sequence information on the sequence name.
-        returnDirs (bool): Whether to return a list of directories as well as sequences.
+        splitSequences (bool): Whether to split sequences or not. With True every contiguous range is a separate entry.
+        extraInformation (bool): Whether or not there should be extra sequence information on the sequence name, the number of frames and missing frames.
+        returnDirs (bool): Whether to return a list of directories as well as sequences. Directories end with `/`.
         returnHidden (bool): Whether to return hidden files and directories.
     Returns:
-        List[str]: Retrieves the filename list.
+        List[str]: Retrieves the filename list, sorted by name, the ranges of a split sequence in frame order.
     """
-    if not os.path.isdir(dir):
+    if not _fileListCacheEnabled:
+        return _listFileNames(dir, splitSequences, extraInformation, returnDirs, returnHidden)
+    try:
+        st = os.stat(dir)
+    except OSError:
         return []
+    key = (os.path.abspath(dir), bool(splitSequences), bool(extraInformation), bool(returnDirs), bool(returnHidden))
+    stamp = (st.st_dev, st.st_ino, st.st_mtime_ns)
+    with _fileListCacheLock:
+        cached = _fileListCache.get(key)
+        if cached is not None and cached[0] == stamp:
+            _fileListCache.move_to_end(key)
+            _fileListCacheStats["hits"] += 1
+            return list(cached[2])
+        _fileListCacheStats["misses"] += 1
+    result = _listFileNames(dir, splitSequences, extraInformation, returnDirs, returnHidden)
+    # files added within the timestamp granularity of the file system may not change the mtime, such listings are not kept
+    if time.time_ns() - st.st_mtime_ns < _fileListCacheRacyNs:
+        with _fileListCacheLock:
+            _fileListCacheStats["racy"] += 1
+        return result
+    size = sys.getsizeof(result) + sum(sys.getsizeof(entry) for entry in result)
+    global _fileListCacheSize
+    with _fileListCacheLock:
+        previous = _fileListCache.pop(key, None)
+        if previous is not None:
+            _fileListCacheSize -= previous[1]
+        if size <= _fileListCacheLimit:
+            _fileListCache[key] = (stamp, size, tuple(result))
+            _fileListCacheSize += size
+            while _fileListCacheSize > _fileListCacheLimit:
+                _, (_, evicted, _) = _fileListCache.popitem(last=False)
+                _fileListCacheSize -= evicted
+                _fileListCacheStats["evictions"] += 1
+    return result
 
-    files = [f for f in os.listdir(dir) if os.path.isfile(os.path.join(dir, f))]
-    seq_dict = {}
-    singles = []
-
-    seq_re = re.compile(r"^(.*?)(\d+)(\.[^.]+)$")
-
-    for f in files:
-        m = seq_re.match(f)
-        if m:
-            prefix, frame, ext = m.groups()
-            pattern = f"{prefix}#{ext}"
-            if pattern not in seq_dict:
-                seq_dict[pattern] = []
-            seq_dict[pattern].append(int(frame))
+def _listFileNames(dir: str, splitSequences: bool, extraInformation: bool, returnDirs: bool, returnHidden: bool) -> List[str]:
+    try:
+        entries = os.scandir(dir)
+    except OSError:
+        return []
+    files = []
+    # (name to sort by, position in a split sequence, entry)
+    result: List[Tuple[str, int, str]] = []
+    with entries:
+        for entry in entries:
+            name = entry.name
+            if name[0] == "." and not returnHidden:
+                continue
+            try:
+                if entry.is_dir():
+                    if returnDirs:
+                        result.append((name + "/", 0, name + "/"))
+                elif entry.is_file():
+                    files.append(name)
+            except OSError:
+                continue
+    sequences, singles = _groupFrameFiles(files)
+    result.extend((name, 0, name) for name in singles)
+    for (prefix, width, ext), frames in sequences.items():
+        ranges = FrameRanges.fromFrames(frames)
+        pattern = f"{prefix}{'#' * width}{ext}"
+        if splitSequences:
+            entries = [(_formatRun(*run), (run[1] - run[0]) // run[2] + 1, 0) for run in ranges.ranges()]
         else:
-            singles.append(f)
-
-    result = []
-    for pattern, frames in seq_dict.items():
-        if frames:
-            frames.sort()
-            result.append(f"{pattern} {frames[0]}-{frames[-1]}")
-    result.extend(singles)
-    return result
+            entries = [(str(ranges), len(ranges), ranges.maxFrame() - ranges.minFrame() + 1 - len(ranges))]
+        for i, (ranges, count, missing) in enumerate(entries):
+            entry = f"{pattern} {ranges}"
+            if extraInformation:
+                entry += f" ({count} frame{'s' if count != 1 else ''}{f', {missing} missing' if missing else ''})"
+            result.append((pattern, i, entry))
+    result.sort()
+    return [entry for _, _, entry in result]
+
+def _scanDirectory(dir: str, returnHidden: bool) -> Tuple[Optional[Tuple[int, int]], List[str]]:
+    """Identity of a directory, to not walk it twice through links, and its split getFileNameList() entries."""
+    try:
+        st = os.stat(dir)
+    except OSError:
+        return None, []
+    return (st.st_dev, st.st_ino), getFileNameList(dir, splitSequences=True, returnDirs=True, returnHidden=returnHidden)
+
+def scanSequences(dir: str, workers: int = 8, returnHidden: bool = False) -> Iterator[str]:
+    """
+    Walk a directory tree and yield its files and sequences as they are found, e.g. `/renders/sh010/beauty.####.exr 1001-1100`.
+    Every contiguous range of a sequence is a separate entry in the `pattern first-last` form File_Knob.fromUserText() reads.
+    Directories are listed by a pool of threads, so on network storage the round trips of several directories overlap.
+    Args:
+        dir (str): Root of the tree.
+        workers (int): Optional. Number of directories listed at a time.
+        returnHidden (bool): Optional. Whether to include hidden files and directories.
+    Returns:
+        Iterator[str]: Files and sequences with their paths, in no particular order.
+    """
+    import concurrent.futures
+
+    workers = max(1, workers)
+    pending = collections.deque([dir.replace("\\", "/").rstrip("/") or "/"])
+    visited = set()
+    executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="scanSequences")
+    running = {}
+    try:
+        while pending or running:
+            # a few directories are queued per thread so a thread never waits for the generator to be resumed
+            while pending and len(running) < workers * 2:
+                path = pending.popleft()
+                running[executor.submit(_scanDirectory, path, returnHidden)] = path
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                identity, entries = future.result()
+                if identity is None or identity in visited:
+                    continue
+                visited.add(identity)
+                prefix = path + "/" if path != "/" else "/"
+                for entry in entries:
+                    if entry.endswith("/"):
+                        pending.append(prefix + entry[:-1])
+                    else:
+                        yield prefix + entry
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 def getFilename(message: str, pattern: str = None, default: str = None, favorites: str = None, type: str = None, multiple: bool = False) -> Union[List[str], str, None]:
     """
@@ -1122,9 +2522,31 @@ def getInput(prompt: str, default: str = "") -> str:
 def execute(nameOrNode, start, end, incr, views, continueOnError=False):
     pass
 
-def delete(n: Node) -> None:
-    """The named node is deleted. It can be recovered with an undo."""
-    root()._nodes.remove(n)
+def delete(n: Union[Node, List[Node]]) -> None:
+    """
+    The named node is deleted. It can be recovered with an undo.
+    A list of nodes is deleted in one pass: the onDestroy callbacks run once per node class, then every node is removed
+    from its group's indexes and disconnected from the nodes that use it. The contents of deleted groups are deleted too.
+    """
+    nodes = [n] if isinstance(n, Node) else list(n)
+    deleted: Dict[Node, None] = {}
+    for node in nodes:
+        if node._parent is None or node in deleted:
+            continue
+        deleted[node] = None
+        if isinstance(node, Group):
+            deleted.update(dict.fromkeys(iterNodes(group=node, recurseGroups=True)))
+    if not deleted:
+        return
+    _runNodeCallbacks(onDestroys, list(deleted))
+    with _graphLock:
+        for node in reversed(deleted):
+            if node._parent is not None:
+                node._parent._removeNode(node)
+                _dirtyNodes.pop(node, None)
+    _scriptChanged(structural=True)
+    if any(isinstance(node, Viewer) for node in deleted):
+        _viewerWindows[:] = [v for v in _viewerWindows if v._node not in deleted]
 
 def ask(prompt: str) -> bool:
     return input(prompt).lower() in ['yes', 'y'] 
@@ -1157,19 +2579,75 @@ def scriptNew():
     """Start a new script. Returns True if successful."""
     return True
 
+def scriptClear(resetToCompiledDefaults: bool = False) -> None:
+    """Clears a Nuke script and resets all the root knobs to their defaults."""
+    delete(root().nodes())
+    defaults = Root()
+    for name in list(_root._data):
+        knob = defaults._data.get(name)
+        if knob is None:
+            del _root._data[name]
+        else:
+            _root._data[name].setValue(knob.value())
+            _root._data[name]._default = knob._default
+
 def scriptOpen(file: str):
-    """Opens a new script containing the contents of the named file."""
-    root().setName(file)
-    for callback_info in onScriptLoads:
-        callback_info["call"](*callback_info["args"], **callback_info["kwargs"])
+    """Opens a new script containing the contents of the named file. In GUI mode the user is offered to restore a newer autosave of it."""
+    with _graphLock:
+        scriptClear()
+        root().setName(file)
+        restored = GUI and autosave.offerRestore()
+        if not restored:
+            scriptReadFile(file)
+        root().setName(file)
+        if GUI:
+            probeReads()
+        _dirtyNodes.clear()
+        if not restored:
+            root().setModified(False)
+    _runNodeCallbacks(onScriptLoads, [root()])
 
 def scriptReadFile(file: str):
-    """Read nodes from a file."""
-    pass
+    """Read nodes from a file into the current group. The file is parsed as it is read, a line at a time, or comes from the script cache if it was read before."""
+    nkscript.readFile(file, thisGroup())
+
+def auditScripts(paths: List[str], func: Callable[[str], Any], workers: int = None, chunksize: int = 1, timeout: float = None) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    """
+    Open every script in a pool of worker processes and call `func(path)` with the script loaded, e.g. to look for missing files in many scripts:
+        def missingReads(path):
+            return [n.name() for n in nuke.allNodes("Read", recurseGroups=True) if not os.path.exists(n["file"].value())]
+
+        if __name__ == "__main__":
+            for path, missing, error in nuke.auditScripts(paths, missingReads, timeout=60):
+                ...
+    Workers run nuke in terminal mode and are reused, every script is opened with scriptOpen() so it only sees its own nodes.
+    Args:
+        paths (List[str]): Script paths.
+        func (Callable[[str], Any]): Module level function, called with the path of the open script. Its result must be picklable.
+        workers (int): Optional. Number of worker processes, the number of CPUs by default.
+        chunksize (int): Optional. Number of scripts sent to a worker at a time.
+        timeout (float): Optional. Seconds a script may take to open and audit. The worker is killed and replaced when it takes longer.
+    Returns:
+        Iterator[Tuple[str, Any, Optional[str]]]: `(path, result, error)` in the order the scripts finish. `error` is None or the traceback text.
+    """
+    import audit
+    return audit.auditScripts(paths, func, workers, chunksize, timeout)
+
+def scriptCacheStats() -> dict:
+    """
+    Statistics of the on-disk cache of parsed scripts used by scriptOpen() and scriptReadFile().
+    Returns:
+        dict: `hits`, `misses`, `writes` and `evictions` in this session, `entries` and `size` (bytes) of the cache.
+    """
+    return nkscript.cacheStats()
+
+def clearScriptCache() -> None:
+    """Remove all files from the on-disk cache of parsed scripts."""
+    nkscript.clearCache()
 
 def scriptReadText(s: str):
     """Read nodes from a string."""
-    pass
+    nkscript.read(io.StringIO(s), thisGroup())
 
 def scriptSave(filename: str = None) -> bool:
     """
@@ -1179,7 +2657,37 @@ def scriptSave(filename: str = None) -> bool:
     Returns:
             bool: True if the file was saved, otherwise an exception is thrown.
     """
-    pass
+    if filename is None:
+        filename = root()["name"].value()
+        if not filename:
+            if not GUI:
+                raise RuntimeError("No file name given and the script has no name")
+            return scriptSaveAs()
+    _runNodeCallbacks(onScriptSaves, [root()])
+    version = _scriptVersion
+    _writeScript(filename)
+    if filename == root()["name"].value():
+        global _savedScriptVersion
+        _savedScriptVersion = version
+        autosave.delete()
+    return True
+
+def _writeScript(filename: str, write: Callable[[TextIO], None] = None) -> None:
+    """Stream the script, or what `write` writes, to a temporary file next to `filename` and move it in place, so a failed save leaves the old file intact."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(filename), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", errors="surrogateescape", buffering=_scriptBufferSize) as f:
+            if write is None:
+                nkscript.write(f, root())
+            else:
+                write(f)
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp, os.stat(filename).st_mode & 0o7777 if os.path.exists(filename) else 0o644)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
 def scriptSaveAs(filename: str = None, overwrite: int = -1) -> None:
     """
@@ -1188,15 +2696,55 @@ def scriptSaveAs(filename: str = None, overwrite: int = -1) -> None:
         filename (str): Saves the current script with the given file name if supplied, or (in GUI mode) asks the user for one using the file chooser.
         overwrite (int): If 1 (true) always overwrite; if 0 (false) never overwrite; otherwise, in GUI mode ask the user, in terminal do same as False. Default is -1, meaning 'ask the user'.    
     """
+    if filename is None:
+        if GUI:
+            filename = getFilename("Save Script As", "*.nk", type="save")
+        if not filename:
+            raise RuntimeError("No file name given")
+    if os.path.exists(filename) and overwrite != 1:
+        if overwrite == 0 or not GUI:
+            raise RuntimeError(f"{filename} already exists")
+        if not ask(f"{filename} already exists. Overwrite?"):
+            return
     root().setName(filename)
+    scriptSave(filename)
+
+# Change tracking. Every change to the script bumps _scriptVersion, structural changes (nodes added, removed,
+# renamed or connected, user knobs added) also bump _structureVersion. Changed nodes are collected for the
+# autosave journal. _graphLock is held while the graph structure changes and while autosave takes a snapshot.
+_scriptVersion = 0
+_structureVersion = 0
+_savedScriptVersion = 0
+_lastChangeTime = 0.0
+_dirtyNodes: Dict[Node, None] = {}
+# the script's Root, created at the end of the module
+_root: Root = None
+_graphLock = threading.RLock()
+
+def _scriptChanged(node: Node = None, structural: bool = False) -> None:
+    global _scriptVersion, _structureVersion, _lastChangeTime
+    # knob changes come here without the lock, the autosave snapshot must not see half of one
+    with _graphLock:
+        _scriptVersion += 1
+        _lastChangeTime = time.monotonic()
+        if structural:
+            _structureVersion += 1
+        if node is not None:
+            _dirtyNodes[node] = None
+
+# nodes whose callbacks are running, the last one is nuke.thisNode()
+_thisNodes: List[Node] = []
+# groups entered with Group.begin(), the last one is nuke.thisGroup()
+_groupStack: List[Group] = []
+_scriptBufferSize = 1 << 20
 
 def thisClass() -> str:
     """Get the class name of the current node. This equivalent to calling nuke.thisNode().Class(), only faster."""
-    return root().Class()
+    return thisNode().Class()
 
 def thisGroup() -> Group:
     """Returns the current context Group node."""
-    return root()
+    return _groupStack[-1] if _groupStack else root()
 
 def thisKnob() -> Knob:
     """Returns the current context knob if any."""
@@ -1204,7 +2752,7 @@ def thisKnob() -> Knob:
 
 def thisNode() -> Node:
     """Return the current context node."""
-    return root()
+    return _thisNodes[-1] if _thisNodes else root()
 
 def thisPane():
     """Returns the active pane. This is only valid during a pane menu callback or window layout restoration."""
@@ -1784,3 +3332,7 @@ _preferences = Preferences()
 _menus = {"Nuke": Menu(), "Nodes": Menu()}
 _viewerWindows: List[ViewerWindow] = []
 _viewerWindows.append(ViewerWindow(createNode("Viewer")))
+_root.setModified(False)
+if GUI and os.environ.get("NUKE_DEBUG_AUTOSAVE", "0") not in ("", "0"):
+    autosave.start()
+_startupTimes["nuke"] = time.perf_counter() - _importStart
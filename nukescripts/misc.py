@@ -2,8 +2,9 @@ import nuke
 
 def clear_selection_recursive(group = nuke.root()):
   """Sets all nodes to unselected, including in child groups."""
-  for n in group.selectedNodes():
-    n.setSelected(False)
-  groups = [i for i in group.nodes() if i.Class() == 'Group']
-  for i in groups:
-    clear_selection_recursive(i)
+  groups = [group]
+  while groups:
+    group = groups.pop()
+    for n in group.selectedNodes():
+      n.setSelected(False)
+    groups.extend(n for n in group.nodes() if isinstance(n, nuke.Group))
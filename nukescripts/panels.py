@@ -7,6 +7,7 @@ except ImportError:
 
 class PythonPanel(QDialog):
     def __init__(self, title="", id="", scrollable=True):
+        nuke._loadQt()
         super().__init__()
         self._knobs: Dict[str, nuke.Knob] = {}
 
@@ -26,9 +27,9 @@ class PythonPanel(QDialog):
     def addKnob(self, knob: nuke.Knob):
         row_index = self.form_layout.rowCount()
         if isinstance(knob, nuke.Boolean_Knob):
-            self.form_layout.addRow("", knob._pyside_object)
+            self.form_layout.addRow("", knob._widget())
         else:
-            self.form_layout.addRow(knob.label(), knob._pyside_object)
+            self.form_layout.addRow(knob.label(), knob._widget())
         label_item = self.form_layout.itemAt(row_index, QFormLayout.LabelRole)
         knob._pyside_object_label_item = label_item
         knob._setPanel(self)
@@ -1,16 +1,37 @@
-import tkinter as tk
 import os
+import re
+import time
+import threading
+import weakref
+import collections
+from typing import List, Optional, Tuple
 import nuke
 
-_tcl = tk.Tcl()
+_tcl = None
 
 def value(knob_path: str) -> str:
-    spl = knob_path.split(".")
-    return nuke.toNode(spl[0]).knob(spl[1]).value()
+    node_path, _, knob_name = knob_path.rpartition(".")
+    return _knobNode(node_path).knob(knob_name).value()
 
-_tcl.createcommand('getenv', os.getenv)
-_tcl.createcommand('value', value)
-_tcl.createcommand('firstof', lambda *args: next((arg for arg in args if arg), ''))
+def _knobNode(node_path: str) -> "nuke.Node":
+    """Node of a `[value]` path, a knob name alone is a knob of nuke.thisNode()."""
+    return nuke.toNode(node_path) if node_path else nuke.thisNode()
+
+def _getenv(name: str, default: str = "") -> str:
+    return os.environ.get(name, default)
+
+def _interpreter():
+    """Tcl interpreter with the Nuke commands registered. Created on first use, importing tkinter is slow."""
+    global _tcl
+    if _tcl is None:
+        start = time.perf_counter()
+        import tkinter as tk
+        _tcl = tk.Tcl()
+        _tcl.createcommand('getenv', _getenv)
+        _tcl.createcommand('value', value)
+        _tcl.createcommand('firstof', lambda *args: next((arg for arg in args if arg), ''))
+        nuke._startupTimes["Tcl"] = time.perf_counter() - start
+    return _tcl
 
 def tcl(s: str, *args) -> str:
     """
@@ -23,6 +44,289 @@ def tcl(s: str, *args) -> str:
         str: Result of TCL command as string.
     """
     if args:
-        return _tcl.call(s, *args)
+        return _interpreter().call(s, *args)
     else:
-        return _tcl.eval(s)
+        return _interpreter().eval(s)
+
+# EvalString knobs are evaluated as `return <text>`, file paths as `subst <text>` so they may have spaces. A text that
+# is one word, or any text for subst, using only [value], [getenv] and [firstof] is parsed once into parts, literal
+# strings and (command, words) tuples, and run in Python, on any thread.
+# Anything else, and any error, goes to the Tcl interpreter so the result or the error is the one Tcl gives.
+# The last result of an expression is reused while the knobs it read keep their _version, the environment variables
+# it read keep their values, the context group and node are the same and no node was created, deleted, renamed or
+# connected.
+# Expressions are kept in an LRU of $NUKE_TCL_CACHE_SIZE entries (default 16384, 0 turns the cache off).
+
+class _Unsupported(Exception):
+    """The text needs the Tcl interpreter."""
+
+class _Expression:
+    __slots__ = ("parts", "memo")
+
+    def __init__(self, parts: Optional[tuple]):
+        # None when the text needs the Tcl interpreter
+        self.parts = parts
+        # (result, structure version, context group, context node or None if no knob of it was read, ((knob, version), ...),
+        # ((variable, value), ...)), group, node and knobs are weak references so memoised results do not keep deleted nodes alive
+        self.memo: Optional[tuple] = None
+
+class _Reads:
+    """Knobs and environment variables read while running an expression, and whether a knob of nuke.thisNode() was read."""
+    __slots__ = ("knobs", "env", "thisNode")
+
+    def __init__(self):
+        self.knobs: List[tuple] = []
+        self.env: List[tuple] = []
+        self.thisNode = False
+
+def _string(value) -> str:
+    """`value` as the Tcl interpreter turns it into a string. Other types than str, bool, int and float are left to it."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or isinstance(value, float) and (value == 0 or 1e-4 <= abs(value) < 1e16):
+        # outside of this range Python and Tcl write floats differently
+        return str(value)
+    raise _Unsupported
+
+def _valueCommand(reads: _Reads, path: str) -> str:
+    nodePath, _, knobName = path.rpartition(".")
+    knob = _knobNode(nodePath).knob(knobName)
+    reads.thisNode = reads.thisNode or not nodePath
+    reads.knobs.append((knob, knob._version))
+    return _string(knob.value())
+
+def _getenvCommand(reads: _Reads, name: str, default: str = "") -> str:
+    value = os.environ.get(name)
+    reads.env.append((name, value))
+    return default if value is None else value
+
+def _firstofCommand(reads: _Reads, *args: str) -> str:
+    return next((arg for arg in args if arg), "")
+
+# name -> (function, least and most arguments)
+_commands = {
+    "value": (_valueCommand, 1, 1),
+    "getenv": (_getenvCommand, 1, 2),
+    "firstof": (_firstofCommand, 0, 1 << 30),
+}
+_backslashes = {"a": "\a", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+_topEnds = " \t"
+_wordEnds = " \t]"
+# subst takes the whole text
+_substEnds = ""
+# runs of characters that stand for themselves, up to the end of the word
+_literalRes = {ends: re.compile("[^%s]+" % re.escape("[\\$;\n\r" + ends)).match for ends in (_topEnds, _wordEnds, '"', _substEnds)}
+
+def _parseWord(text: str, pos: int, ends: str) -> Tuple[tuple, int]:
+    """Parse literal text and [commands] from `pos` up to one of `ends`. Returns the parts and the position of the end."""
+    parts = []
+    literal: List[str] = []
+    literalMatch = _literalRes[ends]
+    while True:
+        match = literalMatch(text, pos)
+        if match is not None:
+            literal.append(match.group())
+            pos = match.end()
+        if pos >= len(text):
+            if ends not in (_topEnds, _substEnds):
+                raise _Unsupported
+            break
+        char = text[pos]
+        if ends and char in ends:
+            break
+        if char == "[":
+            if literal:
+                parts.append("".join(literal))
+                literal = []
+            command, pos = _parseCommand(text, pos + 1)
+            parts.append(command)
+        elif char == "\\":
+            # \xhh, \uhhhh, \ooo and backslash-newline are left to Tcl
+            if pos + 1 >= len(text) or text[pos + 1] in "xuU\n01234567":
+                raise _Unsupported
+            literal.append(_backslashes.get(text[pos + 1], text[pos + 1]))
+            pos += 2
+        elif char == "$" or char in ";\n\r" and ends in (_topEnds, _wordEnds):
+            raise _Unsupported
+        else:
+            literal.append(char)
+            pos += 1
+    if literal:
+        parts.append("".join(literal))
+    return tuple(parts), pos
+
+def _parseCommand(text: str, pos: int) -> Tuple[tuple, int]:
+    """Parse the command from `pos`, after its `[`. Returns (function, words) and the position after the `]`."""
+    words = []
+    while True:
+        while pos < len(text) and text[pos] in " \t":
+            pos += 1
+        if pos >= len(text):
+            raise _Unsupported
+        char = text[pos]
+        if char == "]":
+            break
+        if char == "{":
+            depth = 1
+            end = pos + 1
+            while depth:
+                if end >= len(text) or text[end] == "\\":
+                    raise _Unsupported
+                depth += text[end] == "{"
+                depth -= text[end] == "}"
+                end += 1
+            word, pos = (text[pos + 1:end - 1],), end
+        elif char == '"':
+            word, pos = _parseWord(text, pos + 1, '"')
+            pos += 1
+        else:
+            word, pos = _parseWord(text, pos, _wordEnds)
+        if pos < len(text) and text[pos] not in _wordEnds:
+            raise _Unsupported
+        words.append(word)
+    if not words:
+        return (_firstofCommand, ()), pos + 1
+    if len(words[0]) != 1 or words[0][0] not in _commands:
+        raise _Unsupported
+    function, least, most = _commands[words[0][0]]
+    if not least <= len(words) - 1 <= most:
+        raise _Unsupported
+    return (function, tuple(words[1:])), pos + 1
+
+def _compile(text: str, substitute: bool = False) -> Optional[tuple]:
+    """Parts of `return <text>`, or of `subst <text>`, if Python can run it. None if it needs the Tcl interpreter."""
+    if not substitute and text[:1] in ("{", '"'):
+        return None
+    try:
+        parts, pos = _parseWord(text, 0, _substEnds if substitute else _topEnds)
+    except _Unsupported:
+        return None
+    # more than one word, or whitespace around it
+    return parts if pos == len(text) else None
+
+def _run(parts: tuple, reads: _Reads) -> str:
+    results = []
+    for part in parts:
+        if part.__class__ is str:
+            results.append(part)
+        else:
+            function, words = part
+            results.append(function(reads, *[_run(word, reads) for word in words]))
+    return "".join(results)
+
+def _current(memo: tuple) -> bool:
+    """True while the inputs of a memoised result are unchanged."""
+    _, structure, group, node, knobs, env = memo
+    if structure != nuke._structureVersion or knobs and group() is not nuke.thisGroup():
+        return False
+    if node is not None and node() is not nuke.thisNode():
+        return False
+    for knob, version in knobs:
+        knob = knob()
+        if knob is None or knob._version != version:
+            return False
+    for name, value in env:
+        if os.environ.get(name) != value:
+            return False
+    return True
+
+# (text, whether it is substituted) -> expression
+_expressions: "collections.OrderedDict[Tuple[str, bool], _Expression]" = collections.OrderedDict()
+_expressionsLock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "tcl": 0, "compiled": 0, "evictions": 0}
+try:
+    _cacheLimit = int(os.environ.get("NUKE_TCL_CACHE_SIZE", 16384))
+except ValueError:
+    _cacheLimit = 0
+
+def _count(name: str) -> None:
+    # evaluate() runs on the autosave thread as well
+    with _expressionsLock:
+        _stats[name] += 1
+
+def _expression(text: str, substitute: bool) -> _Expression:
+    key = (text, substitute)
+    with _expressionsLock:
+        expression = _expressions.get(key)
+        if expression is not None:
+            _expressions.move_to_end(key)
+            return expression
+    expression = _Expression(_compile(text, substitute))
+    with _expressionsLock:
+        _stats["compiled"] += 1
+        if _cacheLimit > 0:
+            expression = _expressions.setdefault(key, expression)
+            while len(_expressions) > _cacheLimit:
+                _expressions.popitem(last=False)
+                _stats["evictions"] += 1
+    return expression
+
+def _tclEvaluate(text: str, substitute: bool) -> str:
+    if threading.current_thread() is not threading.main_thread():
+        raise ValueError(f"{text!r} needs the Tcl interpreter, which only runs on the main thread")
+    _count("tcl")
+    return tcl("subst", text) if substitute else tcl(f"return {text}")
+
+def _evaluate(text: str, substitute: bool) -> str:
+    expression = _expression(text, substitute)
+    if expression.parts is None:
+        return _tclEvaluate(text, substitute)
+    memo = expression.memo
+    if memo is not None and _current(memo):
+        _count("hits")
+        return memo[0]
+    _count("misses")
+    structure = nuke._structureVersion
+    group = nuke.thisGroup()
+    reads = _Reads()
+    try:
+        result = _run(expression.parts, reads)
+    except Exception:
+        # the error, or a value only Tcl turns into a string
+        return _tclEvaluate(text, substitute)
+    knobs = tuple((weakref.ref(knob), version) for knob, version in reads.knobs)
+    node = weakref.ref(nuke.thisNode()) if reads.thisNode else None
+    expression.memo = (result, structure, weakref.ref(group), node, knobs, tuple(reads.env))
+    return result
+
+def evaluate(text: str) -> str:
+    """
+    Evaluate the text of an EvalString knob, the same as `tcl("return " + text)`.
+    [value], [getenv] and [firstof] are run in Python and the result is reused until a knob or environment variable it read changes.
+    Args:
+        text (str): The text to evaluate.
+    Returns:
+        str: The text with its commands substituted.
+    Raises:
+        ValueError: If the text needs the Tcl interpreter and this is not the main thread.
+    """
+    return _evaluate(text, False)
+
+def substitute(text: str) -> str:
+    """
+    Substitute the [commands] in a text, e.g. a file path, the same as `tcl("subst", text)`. Spaces and other characters
+    stay as they are. Evaluated and memoised like evaluate().
+    Args:
+        text (str): The text to substitute.
+    Returns:
+        str: The text with its commands substituted.
+    Raises:
+        ValueError: If the text needs the Tcl interpreter and this is not the main thread.
+    """
+    return _evaluate(text, True)
+
+def evaluationStats() -> dict:
+    """
+    Statistics of evaluate() and substitute().
+    Returns:
+        dict: `hits` (memoised results reused), `misses` (expressions run in Python), `tcl` (texts the Tcl interpreter evaluated), `compiled` (texts parsed) and `evictions` in this session, the number of `entries` of the cache and its `limit`.
+    """
+    with _expressionsLock:
+        return dict(_stats, entries=len(_expressions), limit=_cacheLimit)
+
+def clearEvaluationCache() -> None:
+    """Forget all parsed expressions and their results."""
+    with _expressionsLock:
+        _expressions.clear()
@@ -0,0 +1,15 @@
+import os
+import sys
+
+# the tests run nuke in terminal mode, Qt is not needed
+os.environ.setdefault("NUKE_DEBUG_TERMINAL", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import nuke
+
+@pytest.fixture(autouse=True)
+def emptyScript():
+    nuke.scriptClear()
+    yield
+    nuke.scriptClear()
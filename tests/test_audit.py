@@ -0,0 +1,40 @@
+import audit
+import nuke
+
+_script = """Root {
+ inputs 0
+}
+Dot {
+ inputs 0
+ name Dot1
+}
+"""
+
+def _markCreated():
+    nuke.thisNode()["label"].setValue("seen")
+
+def _leaveState(path):
+    # what the script saw, then state a later script must not see
+    seen = (len(nuke.onCreates.get("*", [])), nuke._preferences["AutoSaveIdle"].value(), nuke.createNode("Dot").name())
+    nuke.addOnCreate(_markCreated)
+    nuke._preferences["AutoSaveIdle"].setValue(60.0)
+    for _ in range(3):
+        nuke.createNode("Dot")
+    return seen
+
+def test_scripts_do_not_see_state_of_earlier_scripts(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"script{i}.nk"
+        path.write_text(_script)
+        paths.append(str(path))
+    results = list(audit.auditScripts(paths, _leaveState, workers=1, chunksize=3, timeout=60))
+    assert [error for _, _, error in results] == [None] * 3
+    assert {result for _, result, _ in results} == {(0, 5.0, "Dot2")}
+
+def test_session_restore_clears_callbacks():
+    session = audit._Session()
+    nuke.addOnCreate(_markCreated)
+    session.restore()
+    assert _markCreated not in [call for call, *_ in nuke.onCreates.get("*", [])]
+    assert nuke.createNode("Dot")["label"].value() == ""
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+import nuke
+import autosave
+
+@pytest.fixture
+def autoSaveName(tmp_path):
+    knob = nuke._preferences["AutoSaveName"]
+    previous = knob.value()
+    name = str(tmp_path / "script.nk.autosave")
+    knob.setValue(name)
+    autosave._reset()
+    yield name
+    knob.setValue(previous)
+    autosave._reset()
+
+def test_save_writes_changed_nodes_once(autoSaveName):
+    nuke.createNode("Dot")
+    nuke.createNode("Dot")
+    before = autosave.stats()["nodesWritten"]
+    assert autosave.save() == autoSaveName
+    # every node of the script and the Root
+    assert autosave.stats()["nodesWritten"] - before == len(nuke.allNodes()) + 1
+    assert os.path.isfile(autoSaveName)
+
+def test_delete_during_save_drops_it(autoSaveName, monkeypatch):
+    writeScript = nuke._writeScript
+
+    def writeThenDelete(filename, write=None):
+        writeScript(filename, write)
+        # the script is saved while the autosave is being written
+        autosave.delete()
+
+    monkeypatch.setattr(nuke, "_writeScript", writeThenDelete)
+    nuke.createNode("Dot")
+    assert autosave.save() is None
+    assert os.listdir(os.path.dirname(autoSaveName)) == []
+
+def test_delete_removes_autosave_and_journal(autoSaveName):
+    dot = nuke.createNode("Dot")
+    autosave.save()
+    dot["xpos"].setValue(10)
+    autosave.save()
+    assert os.path.isfile(autoSaveName + ".journal")
+    autosave.delete()
+    assert os.listdir(os.path.dirname(autoSaveName)) == []
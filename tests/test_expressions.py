@@ -0,0 +1,85 @@
+import nuke
+
+class _Signal:
+    def connect(self, slot):
+        self.slot = slot
+
+class _LineEdit:
+    """Stands in for the QLineEdit of a knob, so the panel handler runs without Qt."""
+    def __init__(self):
+        self.textChanged = _Signal()
+        self.string = ""
+
+    def text(self) -> str:
+        return self.string
+
+    def setText(self, string: str) -> None:
+        self.string = string
+
+class _Panel:
+    def knobChanged(self, knob) -> None:
+        pass
+
+def _expressionDependents(node):
+    return [n.name() for n in node.dependent(nuke.EXPRESSIONS)]
+
+def test_setValue_updates_references():
+    read1 = nuke.createNode("Read")
+    read2 = nuke.createNode("Read")
+    write = nuke.createNode("Write")
+    write["file"].setValue("[value Read1.file]")
+    assert _expressionDependents(read1) == ["Write1"]
+    write["file"].setValue("[value Read2.file]")
+    assert _expressionDependents(read1) == []
+    assert _expressionDependents(read2) == ["Write1"]
+
+def test_panel_edit_updates_references():
+    read1 = nuke.createNode("Read")
+    read2 = nuke.createNode("Read")
+    write = nuke.createNode("Write")
+    knob = write["file"]
+    knob.setValue("[value Read1.file]")
+    widget = _LineEdit()
+    knob._pyside_object = widget
+    knob._setPanel(_Panel())
+    widget.setText("[value Read2.file]")
+    widget.textChanged.slot()
+    assert knob.value() == "[value Read2.file]"
+    assert _expressionDependents(read1) == []
+    assert _expressionDependents(read2) == ["Write1"]
+    assert [n.name() for n in write.dependencies(nuke.EXPRESSIONS)] == ["Read2"]
+
+def test_group_rename_keeps_references():
+    group = nuke.createNode("Group")
+    with group:
+        read = nuke.createNode("Read")
+        write = nuke.createNode("Write")
+        write["file"].setValue("[value Read1.file]")
+    group.setName("Shots")
+    assert _expressionDependents(read) == ["Write1"]
+
+def test_getEvaluatedValue_keeps_spaces():
+    read = nuke.createNode("Read")
+    read["file"].setValue("/shots/my shot/[value name].####.exr")
+    assert read["file"].getEvaluatedValue() == "/shots/my shot/Read1.####.exr"
+    read.setName("Plate")
+    assert read["file"].getEvaluatedValue() == "/shots/my shot/Plate1.####.exr"
+
+def test_getEvaluatedValue_matches_tcl_subst():
+    read = nuke.createNode("Read")
+    for path in ("/my shot/[value Read1.name]/a;b", "/a b/[getenv NUKE_DEBUG_NOT_SET]x", "[firstof {} {c d}] e", "/x/\\[/[value name]"):
+        read["file"].setValue(path)
+        nuke._thisNodes.append(read)
+        try:
+            expected = nuke.tcl("subst", path)
+        finally:
+            nuke._thisNodes.pop()
+        assert read["file"].getEvaluatedValue() == expected
+
+def test_evaluate_memoised_result_follows_knob():
+    read = nuke.createNode("Read")
+    write = nuke.createNode("Write")
+    write["file"].setValue("[value Read1.first]")
+    assert write["file"].evaluate() == "0"
+    read["first"].setValue(12)
+    assert write["file"].evaluate() == "12"
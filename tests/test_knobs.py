@@ -0,0 +1,17 @@
+import nuke
+
+def test_enumeration_value_is_name_and_getValue_is_index():
+    knob = nuke.Enumeration_Knob("mode", "mode", ["first", "second", "third"])
+    knob.setValue("third")
+    assert knob.value() == "third"
+    assert knob.getValue() == 2.0
+    assert isinstance(knob.getValue(), float)
+    knob.setValue(1)
+    assert knob.value() == "second"
+    assert knob.getValue() == 1.0
+
+def test_enumeration_getValue_of_unknown_name():
+    knob = nuke.Enumeration_Knob("mode", "mode", ["first", "second"])
+    knob.fromScript("missing")
+    assert knob.value() == "missing"
+    assert knob.getValue() == 0.0
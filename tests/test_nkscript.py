@@ -0,0 +1,50 @@
+import io
+
+import nkscript
+import nuke
+
+_masked = """Constant {
+ inputs 0
+ name Mask1
+}
+Constant {
+ inputs 0
+ name B1
+}
+Constant {
+ inputs 0
+ name A1
+}
+Merge2 {
+ inputs 2+1
+ name Merge1
+}
+"""
+
+def _written() -> str:
+    out = io.StringIO()
+    nkscript.write(out)
+    return out.getvalue()
+
+def test_masked_node_round_trip():
+    nkscript.read(io.StringIO(_masked).readlines())
+    merge = nuke.toNode("Merge1")
+    assert [merge.input(i).name() for i in range(3)] == ["A1", "B1", "Mask1"]
+    text = _written()
+    assert " inputs 2+1\n" in text
+    assert " inputs 3\n" not in text
+    nuke.scriptClear()
+    nkscript.read(io.StringIO(text).readlines())
+    assert [nuke.toNode("Merge1").input(i).name() for i in range(3)] == ["A1", "B1", "Mask1"]
+    assert _written() == text
+
+def test_masked_node_keeps_its_inputs_when_the_mask_is_disconnected():
+    nkscript.read(io.StringIO(_masked).readlines())
+    nuke.toNode("Merge1").setInput(2, None)
+    text = _written()
+    assert " inputs 2+1\n" in text
+    nuke.scriptClear()
+    nkscript.read(io.StringIO(text).readlines())
+    merge = nuke.toNode("Merge1")
+    assert [merge.input(i).name() for i in range(2)] == ["A1", "B1"]
+    assert merge.input(2) is None
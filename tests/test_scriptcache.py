@@ -0,0 +1,42 @@
+import os
+
+import pytest
+import nkscript
+import nuke
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "getuid"), reason="ownership is only checked on POSIX")
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    monkeypatch.setenv("NUKE_TEMP_DIR", str(tmp_path / "temp"))
+    monkeypatch.setenv("NUKE_SCRIPT_CACHE_SIZE", "16")
+    path = tmp_path / "script.nk"
+    path.write_text("Dot {\n inputs 0\n name Dot1\n}\n")
+    return str(path)
+
+def _read(path):
+    nuke.scriptClear()
+    before = dict(nkscript._cacheStats)
+    names = [node.name() for node in nkscript.readFile(path)]
+    return names, {name: nkscript._cacheStats[name] - before[name] for name in before}
+
+def test_cache_is_reused(script):
+    assert _read(script)[1]["writes"] == 1
+    names, counts = _read(script)
+    assert names == ["Dot1"]
+    assert counts["hits"] == 1
+    assert os.stat(nkscript._cacheDirectory()).st_mode & 0o777 == 0o700
+
+def test_cache_file_writable_by_others_is_not_loaded(script):
+    _read(script)
+    os.chmod(nkscript._cacheFile(script), 0o666)
+    names, counts = _read(script)
+    assert names == ["Dot1"]
+    assert counts["hits"] == 0
+
+def test_cache_directory_writable_by_others_is_not_used(script):
+    _read(script)
+    os.chmod(nkscript._cacheDirectory(), 0o777)
+    names, counts = _read(script)
+    assert names == ["Dot1"]
+    assert counts == {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
@@ -0,0 +1,19 @@
+import pytest
+import nuke
+
+# nukescripts imports its panels, which need Qt
+pytest.importorskip("PySide6")
+import nukescripts.misc
+
+def test_clear_selection_recursive():
+    dot = nuke.createNode("Dot")
+    group = nuke.createNode("Group")
+    with group:
+        inner = nuke.createNode("Dot")
+    dot.setSelected(True)
+    group.setSelected(True)
+    inner.setSelected(True)
+    nukescripts.misc.clear_selection_recursive()
+    assert nuke.selectedNodes() == []
+    assert group.selectedNodes() == []
+    assert not inner["selected"].value()